@@ -0,0 +1,14 @@
+bl_info = {
+    'name': 'SFM scale flexes generator',
+    'blender': (3, 2, 1)
+}
+
+# Blender is only imported when the add-on gets enabled, the DMX and controller modules
+# can be used from plain Python
+def register():
+    from . import addon
+    addon.register()
+
+def unregister():
+    from . import addon
+    addon.unregister()
@@ -0,0 +1,4 @@
+import sys
+from .controllers import main
+
+sys.exit(main(sys.argv[1:]))
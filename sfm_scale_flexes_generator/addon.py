@@ -0,0 +1,914 @@
+import bpy, os, sys, struct, hashlib, json, time, ctypes, traceback
+import numpy as np
+from fnmatch import fnmatchcase
+from subprocess import check_call
+from concurrent.futures import ThreadPoolExecutor
+from .controllers import build_controllers, write_controllers
+from .shape_keys import ShapeKeyIndex, key_owner
+from .timings import StageTimings
+
+def clean_crowbar_shape_key_names(obj):
+    # Crowbar names the keys of stereo flexes after both sides, keep the left side's name only.
+    # Returns the keys left alone because their new name is already used
+    index = ShapeKeyIndex(obj)
+    renames = {}
+    for name in index.names():
+        if '+' in name:
+            new_name = name.split('+')[0]
+            if new_name.endswith('L'):
+                new_name = new_name[:-1]
+            if new_name != '':
+                renames[name] = new_name
+    return index.rename(renames)
+
+class CrowbarShapekeyCleanerOperator(bpy.types.Operator):    
+    bl_idname = 'opr.crowbar_shapekey_cleaner'
+    bl_label = 'Cleanup Crobar shape keys'
+    bl_description = "Removes _L _R suffixes from shape key names. Needed for restoration with controller source file"
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        timings = StageTimings()
+        with timings.stage('rename'):
+            conflicts = clean_crowbar_shape_key_names(bpy.context.active_object)
+        record_timings(context, self.bl_label, timings)
+        if len(conflicts) != 0:
+            self.report({'WARNING'}, "Kept the names of keys whose cleaned up name is already used: {}".format(", ".join(conflicts)))
+            
+        return {'FINISHED'}
+        
+class ExaggerateShapeKeysOperator(bpy.types.Operator):    
+    bl_idname = 'opr.exaggerate_shapekeys_operator'
+    bl_label = 'Exaggerate shape keys'
+    bl_description = 'Multiplies the offsets of shape keys on the selected mesh by a given number, in place'
+    bl_options = {'REGISTER', 'UNDO'}
+    
+    def execute(self, context):
+        VALUE = context.scene.exaggeration_multiplier
+        FILTER = context.scene.exaggeration_filter
+        ACTIVE_ONLY = context.scene.exaggeration_active_only
+        selection = bpy.context.active_object
+        if selection.data.shape_keys == None:
+            return {'CANCELLED'}
+        keys = selection.data.shape_keys.key_blocks
+        targets = keys[1:]
+        if ACTIVE_ONLY:
+            targets = [selection.active_shape_key] if selection.active_shape_key_index > 0 else []
+        patterns = [pattern.strip() for pattern in FILTER.split(',') if pattern.strip() != '']
+        if len(patterns) != 0:
+            targets = [key for key in targets if any(fnmatchcase(key.name, pattern) for pattern in patterns)]
+
+        # Read the keys others are relative to before any of them gets modified
+        timings = StageTimings()
+        relative = {}
+        with timings.stage('read'):
+            for key in targets:
+                if key.relative_key.name not in relative:
+                    relative[key.relative_key.name] = read_shape_key_co(key.relative_key)
+        for key in targets:
+            basis = relative[key.relative_key.name]
+            with timings.stage('read'):
+                co = read_shape_key_co(key)
+            with timings.stage('key writes'):
+                write_shape_key_co(key, basis + (co - basis) * VALUE)
+        with timings.stage('update'):
+            selection.data.update()
+        record_timings(context, self.bl_label, timings)
+
+        return {'FINISHED'}
+
+class RemoveBoneScaleShapeKeysOperator(bpy.types.Operator):
+    bl_idname = "opr.remove_bone_scale_shapekeys_operator"
+    bl_label = "Remove bone scaling shape keys"
+    bl_description = "Remove bone scaling shape keys from every mesh deformed by the active armature.\n\nSelect the armature and enter pose mode to pick which bones to remove shape keys for"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        timings = StageTimings()
+        key_owners = [key_owner(bone.name) for bone in bpy.context.selected_pose_bones]
+        removed = 0
+        with timings.stage('cleanup'):
+            for selection in get_deformed_meshes(bpy.context.active_object, context.view_layer.objects):
+                index = ShapeKeyIndex(selection)
+                removed += index.remove(index.owned_by(key_owners))
+        record_timings(context, self.bl_label, timings)
+        self.report({'INFO'}, "Removed {} shape keys".format(removed))
+
+        return {'FINISHED'}
+
+class RemoveObjectScaleShapeKeysOperator(bpy.types.Operator):
+    bl_idname = "opr.remove_object_scale_shapekeys_operator"
+    bl_label = "Remove object scaling shape keys"
+    bl_description = "Remove object scaling shape keys"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        timings = StageTimings()
+        selection = bpy.context.active_object
+        with timings.stage('cleanup'):
+            index = ShapeKeyIndex(selection)
+            removed = index.remove(index.owned_by([key_owner(selection.name)]))
+        record_timings(context, self.bl_label, timings)
+        self.report({'INFO'}, "Removed {} shape keys".format(removed))
+
+        return {'FINISHED'}
+    
+def read_shape_key_co(key):
+    co = np.empty(len(key.data) * 3, dtype=np.float32)
+    key.data.foreach_get('co', co)
+    return co.reshape(-1, 3)
+
+def read_basis_co(obj):
+    # Basis shape of a mesh, its vertices if it has no shape keys yet
+    if obj.data.shape_keys != None:
+        return read_shape_key_co(obj.data.shape_keys.reference_key)
+    co = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+    obj.data.vertices.foreach_get('co', co)
+    return co.reshape(-1, 3)
+
+def write_shape_key_co(key, co):
+    key.data.foreach_set('co', np.ascontiguousarray(co, dtype=np.float32).ravel())
+
+def transform_co(co, matrix):
+    return co @ matrix[:3, :3].T + matrix[:3, 3]
+
+def get_deform_weights(obj, arm):
+    # Vertex group -> vertex index of every deforming bone: the indices of the weighted vertices
+    # and their weights, collected in a single pass over the vertices
+    group_bones = {}
+    for group in obj.vertex_groups:
+        bone = arm.data.bones.get(group.name)
+        if bone is not None and bone.use_deform:
+            group_bones[group.index] = group.name
+    indices = {name: [] for name in group_bones.values()}
+    weights = {name: [] for name in group_bones.values()}
+    for vertex in obj.data.vertices:
+        for group in vertex.groups:
+            name = group_bones.get(group.group)
+            if name is not None and group.weight != 0:
+                indices[name].append(vertex.index)
+                weights[name].append(group.weight)
+    return {name: (np.array(indices[name], dtype=np.int64), np.array(weights[name])) for name in indices}
+
+def unparented_pose_matrices(arm):
+    # Armature space pose matrices the bones would have with their parents cleared, and the inverses
+    # of their rest matrices. They only depend on the armature, every deformed mesh shares them
+    pose, rest_inv = {}, {}
+    for bone in arm.pose.bones:
+        matrix_local = arm.data.bones[bone.name].matrix_local
+        pose[bone.name] = np.array(matrix_local @ bone.matrix_basis)
+        rest_inv[bone.name] = np.array(matrix_local.inverted())
+    return pose, rest_inv
+
+def get_deformed_meshes(arm, objects):
+    # Meshes with an Armature modifier pointing at the armature, whatever the modifier is named
+    return [obj for obj in objects if obj.type == 'MESH' and any(modifier.type == 'ARMATURE' and modifier.object == arm for modifier in obj.modifiers)]
+
+def unsupported_deform_settings(meshes, arm):
+    # Armature modifier settings BoneScaleDeformer doesn't reproduce, keys of meshes using them would
+    # differ from the modifier output. Returns a description for every such mesh
+    unsupported = []
+    for obj in meshes:
+        modifiers = [modifier for modifier in obj.modifiers if modifier.type == 'ARMATURE' and modifier.object == arm]
+        settings = []
+        if len(modifiers) > 1:
+            settings.append("{} Armature modifiers".format(len(modifiers)))
+        for modifier in modifiers:
+            if modifier.use_deform_preserve_volume: settings.append("preserve volume")
+            if modifier.use_bone_envelopes: settings.append("bone envelopes")
+            if not modifier.use_vertex_groups: settings.append("vertex groups disabled")
+            if modifier.vertex_group != '': settings.append("vertex group mask")
+            if modifier.use_multi_modifier: settings.append("multi modifier")
+        if len(settings) != 0:
+            unsupported.append("{} ({})".format(obj.name, ", ".join(settings)))
+    return unsupported
+
+FINGERPRINTS_PROP = 'sfm_scale_fingerprints'
+PRUNED_PREFIX = 'pruned:' # fingerprints of keys that came out empty and weren't created
+
+class BoneScaleDeformer:
+    # Linear blend skinning of the basis shape, matching the Armature modifier output
+    # for a pose where a single bone gets scaled along one of its axes. Only the vertices
+    # weighted to the scaled bones (and the ones moved by the current pose) are evaluated
+
+    def __init__(self, obj, arm, bone_matrices):
+        self.basis = read_basis_co(obj).astype(np.float64)
+        self.weights = get_deform_weights(obj, arm)
+        to_arm = arm.matrix_world.inverted() @ obj.matrix_world
+        self.to_arm = np.array(to_arm)
+        self.from_arm = np.array(to_arm.inverted())
+        pose, rest_inv = bone_matrices
+        self.pose = {name: pose[name] for name in self.weights}
+        self.rest_inv = {name: rest_inv[name] for name in self.weights}
+        self.deform = {name: self.deform_matrix(name, (1, 1, 1)) for name in self.weights}
+
+        contrib = np.zeros(len(self.basis))
+        offset = np.zeros_like(self.basis)
+        for name, (indices, weight) in self.weights.items():
+            contrib[indices] += weight
+            # Bones in their rest pose don't move anything, skipping them keeps the posed shape
+            # bit-identical to the basis shape instead of picking up rounding noise
+            if not np.allclose(self.deform[name], np.identity(4), rtol=0, atol=1e-6):
+                co = self.basis[indices]
+                offset[indices] += weight[:, None] * (transform_co(co, self.deform[name]) - co)
+        # Same threshold the Armature modifier uses to leave unweighted vertices in place
+        self.normalize = np.divide(1, contrib, out=np.zeros_like(contrib), where=contrib > 0.0001)
+        self.posed_offset = offset * self.normalize[:, None]
+        self.posed_indices = np.flatnonzero(np.any(self.posed_offset != 0, axis=1))
+        self.base_fingerprint = None
+
+    def deform_matrix(self, bone_name, scale):
+        return self.from_arm @ self.pose[bone_name] @ np.diag([*scale, 1]) @ self.rest_inv[bone_name] @ self.to_arm
+
+    def affected_indices(self, bone_names):
+        indices = [self.weights[name][0] for name in bone_names if name in self.weights]
+        return np.unique(np.concatenate([self.posed_indices] + indices))
+
+    def scaled_offset(self, bone_name, axis, value):
+        # Indices of the affected vertices and their offsets from the basis shape
+        return self.merged_offset([bone_name], axis, value)
+
+    def merged_offset(self, bone_names, axis, value):
+        # Same as scaled_offset, for the sum of the offsets of every bone
+        scale = [1, 1, 1]
+        scale[axis] = value
+        indices = self.affected_indices(bone_names)
+        offset = self.posed_offset[indices] * len(bone_names)
+        for name in bone_names:
+            if name not in self.weights:
+                continue
+            bone_indices, weight = self.weights[name]
+            delta = self.deform_matrix(name, scale) - self.deform[name]
+            rows = np.searchsorted(indices, bone_indices)
+            offset[rows] += (weight * self.normalize[bone_indices])[:, None] * transform_co(self.basis[bone_indices], delta)
+        return indices, offset
+
+    def fingerprint(self, bone_names, axis, value, epsilon):
+        # Hash of everything the key of the given bones is computed from, the empty key threshold included
+        if self.base_fingerprint is None:
+            digest = hashlib.sha1(self.basis.tobytes())
+            digest.update(self.posed_offset.tobytes())
+            digest.update(self.to_arm.tobytes())
+            self.base_fingerprint = digest.digest()
+        digest = hashlib.sha1(self.base_fingerprint)
+        digest.update(struct.pack('<idd', axis, value, epsilon))
+        for name in bone_names:
+            digest.update(name.encode('utf-8') + b'\0')
+            if name in self.weights:
+                indices, weight = self.weights[name]
+                digest.update(indices.tobytes())
+                digest.update((weight * self.normalize[indices]).tobytes())
+                digest.update(self.pose[name].tobytes())
+                digest.update(self.rest_inv[name].tobytes())
+        return digest.hexdigest()
+
+def bone_scale_jobs(bone_names, active_bone_name, axis, scaling, merge):
+    # Owner names of the keys and the key name, bones, axis index and scale value of every key to generate
+    key_owners = [key_owner(name) for name in bone_names]
+    jobs = []
+    if merge:
+        # Sum the per-bone deltas of every key into a single key per axis and direction
+        key_owners.append(key_owner(active_bone_name))
+        for a in axis:
+            for j in range(len(scaling)):
+                name = key_owners[-1] + '--{}{}'.format('pos' if j == 0 else 'neg', a[0])
+                jobs.append((name, bone_names, a[1], scaling[j]))
+    else:
+        for bone_name in bone_names:
+            for a in axis:
+                for j in range(len(scaling)):
+                    name = key_owner(bone_name) + '--{}{}'.format('pos' if j == 0 else 'neg', a[0])
+                    jobs.append((name, [bone_name], a[1], scaling[j]))
+    return key_owners, jobs
+
+def evaluate_bone_scale_key(deformer, job, epsilon):
+    # Offsets of a key, None for an empty one. Only touches numpy arrays so keys can be
+    # evaluated on worker threads
+    name, bones, axis_index, value = job
+    indices, offset = deformer.merged_offset(bones, axis_index, value)
+    if len(indices) == 0 or np.sqrt((offset ** 2).sum(axis=1)).max() < epsilon:
+        return name, None, None
+    return name, indices, offset
+
+STAGED_SUFFIX = ' (generating)'
+
+class BoneScaleGeneration:
+    # Bone scaling keys of every mesh deformed by an armature. The meshes are set up one at a time,
+    # then keys are evaluated a chunk at a time and written under a temporary name right away, so only
+    # the keys in flight are held in memory.
+    # Commit swaps them in for the outdated keys, cancel removes them and leaves the meshes as they were
+
+    def __init__(self, arm, meshes, key_owners, jobs, epsilon, timings=None):
+        self.timings = timings if timings != None else StageTimings()
+        with self.timings.stage('pose evaluation'):
+            self.bone_matrices = unparented_pose_matrices(arm)
+        self.arm = arm
+        self.objects = meshes
+        self.key_owners = key_owners
+        self.jobs = jobs
+        self.epsilon = epsilon
+        self.meshes = [] # object, deformer, stored and wanted fingerprints, outdated keys
+        self.buffers = [] # basis shape and key buffer of every mesh
+        self.staged = [] # written keys of every mesh
+        self.empty = [] # names of the pruned keys of every mesh
+        self.added_basis = [] # meshes that had no shape keys
+        self.pending = [] # mesh index and job of every key to evaluate
+        self.pool = None
+        self.skipped = 0
+        self.pruned = []
+        self.pruned_bytes = 0
+        self.kept = set() # names of the keys present on any of the meshes
+        self.total = 0
+        self.done = 0
+
+    def setup_mesh(self):
+        # Sets up the deformer of the next mesh and queues its keys that need to be evaluated
+        obj = self.objects[len(self.meshes)]
+        with self.timings.stage('pose evaluation'):
+            deformer = BoneScaleDeformer(obj, self.arm, self.bone_matrices)
+
+        # Keys are tagged with a fingerprint of their inputs, only the ones that changed get rebuilt
+        shape_keys = obj.data.shape_keys
+        stored = shape_keys.get(FINGERPRINTS_PROP) if shape_keys != None else None
+        fingerprints = stored.to_dict() if stored is not None else {}
+        with self.timings.stage('fingerprints'):
+            wanted = {name: deformer.fingerprint(bones, axis_index, value, self.epsilon) for name, bones, axis_index, value in self.jobs}
+
+        # Existing keys that are outdated or no longer wanted get deleted on commit. Keys pruned
+        # by an earlier run are current as long as their fingerprint still matches
+        index = ShapeKeyIndex(obj)
+        outdated = [name for name in index.owned_by(self.key_owners) if fingerprints.get(name) != wanted.get(name)]
+        current = set(index.names()[1:]) - set(outdated)
+        current.update(name for name in wanted if name not in index.by_name and fingerprints.get(name) == PRUNED_PREFIX + wanted[name])
+        todo = [job for job in self.jobs if job[0] not in current]
+        self.skipped += len(self.jobs) - len(todo)
+        self.kept.update(job[0] for job in self.jobs if job[0] in current and job[0] in index.by_name)
+        self.pending += [(len(self.meshes), job) for job in todo]
+        self.meshes.append((obj, deformer, fingerprints, wanted, outdated))
+        self.buffers.append(None)
+        self.staged.append([])
+        self.empty.append([])
+        self.total = len(self.pending)
+
+    def finished(self):
+        return len(self.meshes) == len(self.objects) and self.done == self.total
+
+    def progress(self):
+        # Steps done and to do, setting up a mesh and evaluating a key count as one step each.
+        # Meshes still to set up are counted with all of their keys
+        remaining = len(self.objects) - len(self.meshes)
+        return len(self.meshes) + self.done, len(self.objects) + self.total + remaining * len(self.jobs)
+
+    def status(self):
+        if len(self.meshes) < len(self.objects):
+            return "setting up {} ({}/{} meshes)".format(self.objects[len(self.meshes)].name, len(self.meshes) + 1, len(self.objects))
+        return "{}/{} shape keys".format(self.done, self.total)
+
+    def evaluate(self, count=None):
+        # Sets up the next mesh if any is left, otherwise evaluates and writes the next count keys.
+        # Everything that's left if count isn't given
+        while len(self.meshes) < len(self.objects):
+            self.setup_mesh()
+            if count != None:
+                return
+        end = self.total if count == None else min(self.total, self.done + count)
+        workers = os.cpu_count() or 1
+        # The worker threads last for the whole generation, modal operators evaluate a chunk at a time
+        if self.pool == None:
+            self.pool = ThreadPoolExecutor(max_workers=workers)
+        while self.done < end:
+            items = self.pending[self.done:min(end, self.done + workers * 2)]
+            with self.timings.stage('key evaluation'):
+                results = list(self.pool.map(lambda item: evaluate_bone_scale_key(self.meshes[item[0]][1], item[1], self.epsilon), items))
+            with self.timings.stage('key writes'):
+                for (mesh_index, job), (name, indices, offset) in zip(items, results):
+                    self.stage_key(mesh_index, name, indices, offset)
+            self.done += len(items)
+
+    def close(self):
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def stage_key(self, mesh_index, name, indices, offset):
+        obj, deformer = self.meshes[mesh_index][:2]
+        if self.buffers[mesh_index] == None:
+            basis = deformer.basis.astype(np.float32)
+            self.buffers[mesh_index] = (basis, basis.copy())
+        basis, buffer = self.buffers[mesh_index]
+        if indices is None:
+            self.pruned.append(name)
+            self.empty[mesh_index].append(name)
+            self.pruned_bytes += basis.nbytes
+            return
+        if obj.data.shape_keys == None:
+            obj.shape_key_add(name="Basis")
+            self.added_basis.append(obj)
+
+        # Keys are written from a single buffer holding the basis shape, only the affected
+        # vertices get changed and restored for each key
+        buffer[indices] = deformer.basis[indices] + offset
+        key = obj.shape_key_add(name=name + STAGED_SUFFIX, from_mix=False)
+        write_shape_key_co(key, buffer)
+        buffer[indices] = basis[indices]
+        self.staged[mesh_index].append((name, key))
+
+    def commit(self):
+        # Replaces the outdated keys with the written ones, returns the number of generated, skipped
+        # and pruned keys, the memory the pruned keys would have used and the scale controllers they saved
+        self.close()
+        generated = 0
+        for (obj, deformer, fingerprints, wanted, outdated), staged, empty in zip(self.meshes, self.staged, self.empty):
+            shape_keys = obj.data.shape_keys
+            if shape_keys == None:
+                continue
+            with self.timings.stage('cleanup'):
+                for name in outdated:
+                    fingerprints.pop(name, None)
+                index = ShapeKeyIndex(obj)
+                index.remove(outdated)
+                # The outdated keys are gone, so no other key uses the names the staged keys take
+                for name, key in staged:
+                    key.name = name
+                    fingerprints[name] = wanted[name]
+                    self.kept.add(name)
+                    generated += 1
+                # Pruned keys are fingerprinted too, so reruns skip them until their inputs change
+                for name in empty:
+                    fingerprints[name] = PRUNED_PREFIX + wanted[name]
+                shape_keys[FINGERPRINTS_PROP] = fingerprints
+            with self.timings.stage('update'):
+                obj.data.update()
+
+        # Controllers are shared by every mesh of the model, one is only saved when both directions
+        # of an axis are empty on all of them
+        pruned_axes = set(name[:-6] + name[-1] for name in self.pruned)
+        saved_controllers = len([axis_name for axis_name in pruned_axes if not any(axis_name[:-1] + direction + axis_name[-1] in self.kept for direction in ('--pos', '--neg'))])
+        return generated, self.skipped, len(self.pruned), self.pruned_bytes, saved_controllers
+
+    def cancel(self):
+        self.close()
+        for (obj, *_), staged in zip(self.meshes, self.staged):
+            for name, key in reversed(staged):
+                obj.shape_key_remove(key)
+        for obj in self.added_basis:
+            obj.shape_key_clear()
+        for obj, *_ in self.meshes:
+            obj.data.update()
+
+def generate_bone_scale_keys(arm, meshes, key_owners, jobs, epsilon, timings=None):
+    generation = BoneScaleGeneration(arm, meshes, key_owners, jobs, epsilon, timings)
+    generation.evaluate()
+    return generation.commit()
+
+def peak_memory():
+    # Highest memory use of the Blender process so far in bytes, shape keys and undo steps included.
+    # It never goes down for the life of the process. None where it can't be read
+    if os.name == 'nt':
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [(name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        kernel32 = ctypes.WinDLL('kernel32')
+        psapi = ctypes.WinDLL('psapi')
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        counters = PROCESS_MEMORY_COUNTERS(cb=ctypes.sizeof(PROCESS_MEMORY_COUNTERS))
+        if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Events still handled by Blender while a generation runs, so the viewport can be navigated
+NAVIGATION_EVENTS = {'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE', 'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE', 'TRACKPADPAN', 'TRACKPADZOOM', 'NDOF_MOTION'}
+
+class ChunkedGeneration:
+    # Operator mixin running a generation in timer-driven chunks when invoked from the UI, with a
+    # progress bar, an ETA and Esc to cancel. Operators implement prepare(context), returning the
+    # generation or None on errors, and finish(context, generation) committing it and returning
+    # the report. Generations implement evaluate(count), finished(), progress() returning the steps
+    # done and to do, status(), commit() and cancel(). Called from scripts, the generation runs in one go.
+    # Either way the operator makes a single undo step, reports the peak memory of Blender and how
+    # much the run raised it, and records the time spent in every stage
+    bl_options = {'REGISTER', 'UNDO'}
+    CHUNK_TIME = 0.05 # seconds of work per timer event
+
+    def execute(self, context):
+        self.timings = StageTimings()
+        self.start_peak = peak_memory()
+        generation = self.prepare(context)
+        if generation == None:
+            return {'CANCELLED'}
+        generation.evaluate()
+        return self.complete(context, generation)
+
+    def invoke(self, context, event):
+        self.timings = StageTimings()
+        self.start_peak = peak_memory()
+        self.generation = self.prepare(context)
+        if self.generation == None:
+            return {'CANCELLED'}
+        self.active = context.view_layer.objects.active
+        self.mode = self.active.mode if self.active != None else 'OBJECT'
+        self.start = time.perf_counter()
+        window_manager = context.window_manager
+        window_manager.progress_begin(0, 1)
+        self.timer = window_manager.event_timer_add(0.01, window=context.window)
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.abort(context)
+            self.report({'WARNING'}, "Cancelled, no shape keys were changed")
+            return {'CANCELLED'}
+        if event.type == 'TIMER':
+            generation = self.generation
+            deadline = time.perf_counter() + self.CHUNK_TIME
+            try:
+                generation.evaluate(os.cpu_count() or 1)
+                while not generation.finished() and time.perf_counter() < deadline:
+                    generation.evaluate(os.cpu_count() or 1)
+            except Exception as error:
+                # The timer, progress bar and staged keys would otherwise outlive the operator
+                traceback.print_exc()
+                self.abort(context)
+                self.report({'ERROR'}, "Generation failed, no shape keys were changed: {}".format(error))
+                return {'CANCELLED'}
+            if generation.finished():
+                self.stop(context)
+                return self.complete(context, generation)
+            done, total = generation.progress()
+            eta = (time.perf_counter() - self.start) / max(done, 1) * (total - done)
+            context.window_manager.progress_update(done / total)
+            context.workspace.status_text_set("{}: {}, about {:.0f}s left. Press Esc to cancel".format(self.bl_label, generation.status(), eta))
+            return {'RUNNING_MODAL'}
+        if event.type in NAVIGATION_EVENTS:
+            return {'PASS_THROUGH'}
+        return {'RUNNING_MODAL'}
+
+    def abort(self, context):
+        self.stop(context)
+        self.generation.cancel()
+        # Only the active object and its mode may need to be put back
+        if context.view_layer.objects.active != self.active:
+            context.view_layer.objects.active = self.active
+        if self.active != None and self.active.mode != self.mode:
+            bpy.ops.object.mode_set(mode=self.mode)
+
+    def stop(self, context):
+        window_manager = context.window_manager
+        window_manager.event_timer_remove(self.timer)
+        window_manager.progress_end()
+        context.workspace.status_text_set(None)
+
+    def complete(self, context, generation):
+        report = self.finish(context, generation)
+        # The peak is kept for the life of Blender, so the run only shows in how much it grew
+        peak = peak_memory()
+        if peak != None and self.start_peak != None:
+            report += ", Blender peak memory {:.1f} MB (+{:.1f} MB during this run)".format(peak / 2**20, (peak - self.start_peak) / 2**20)
+        self.report({'INFO'}, report)
+        record_timings(context, self.bl_label, self.timings)
+
+        return {'FINISHED'}
+
+class GenerateBoneScaleShapeKeysOperator(ChunkedGeneration, bpy.types.Operator):
+    bl_idname = 'opr.generate_bone_scale_shapekeys_operator'
+    bl_label = 'Generate scale shape keys'
+    bl_description = 'Generates shape keys for negative and positive bone scaling on specified axis for every mesh deformed by the active armature.\n\nSelect the armature and enter pose mode to pick which bones to generate shape keys for'
+
+    def prepare(self, context):
+        POSITIVE_SCALING = context.scene.positive_scaling
+        NEGATIVE_SCALING = context.scene.negative_scaling
+        ENABLE_X = context.scene.enable_x
+        ENABLE_Y = context.scene.enable_y
+        ENABLE_Z = context.scene.enable_z
+        MERGE_KEYS = context.scene.enable_key_merge
+        EPSILON = context.scene.empty_key_threshold
+
+        with self.timings.stage('setup'):
+            bone_names = [bone.name for bone in bpy.context.selected_pose_bones]
+            active_bone_name = bpy.context.active_bone.name
+            arm = bpy.context.active_object
+            meshes = get_deformed_meshes(arm, context.view_layer.objects)
+        if len(meshes) == 0:
+            self.report({'ERROR'}, "No mesh is deformed by {}".format(arm.name))
+            return None
+        unsupported = unsupported_deform_settings(meshes, arm)
+        if len(unsupported) != 0:
+            self.report({'ERROR'}, "Armature settings that scale keys can't be generated with: {}".format(", ".join(unsupported)))
+            return None
+
+        # Make shape keys
+        axis = []
+        if ENABLE_X: axis.append(('X', 0))
+        if ENABLE_Y: axis.append(('Y', 1))
+        if ENABLE_Z: axis.append(('Z', 2))
+        scaling = [POSITIVE_SCALING, NEGATIVE_SCALING]
+        with self.timings.stage('setup'):
+            selected_bones = [bone.name for bone in arm.pose.bones if bone.name in bone_names]
+            key_owners, jobs = bone_scale_jobs(selected_bones, active_bone_name, axis, scaling, MERGE_KEYS)
+        self.mesh_count = len(meshes)
+        return BoneScaleGeneration(arm, meshes, key_owners, jobs, EPSILON, self.timings)
+
+    def finish(self, context, generation):
+        generated, skipped, pruned, pruned_bytes, saved_controllers = generation.commit()
+
+        report = "Generated {} shape keys on {} meshes, skipped {} unchanged".format(generated, self.mesh_count, skipped)
+        if pruned != 0:
+            report += ", pruned {} empty keys ({:.1f} MB, {} controllers saved)".format(pruned, pruned_bytes / 2**20, saved_controllers)
+        return report
+
+class ObjectScaleGeneration:
+    # Object scaling keys. There are six of them at most, they are kept in memory and only written on commit
+
+    def __init__(self, obj, axis, scaling, pivot_mode, timings=None):
+        self.timings = timings if timings != None else StageTimings()
+        self.obj = obj
+        self.owner = key_owner(obj.name)
+        with self.timings.stage('setup'):
+            self.basis = read_basis_co(obj).astype(np.float64)
+        self.pivot = np.zeros(3)
+        if pivot_mode == 'MEDIAN' and len(self.basis) != 0:
+            self.pivot = self.basis.mean(axis=0)
+        if pivot_mode == 'BOUNDS' and len(self.basis) != 0:
+            self.pivot = (self.basis.min(axis=0) + self.basis.max(axis=0)) / 2
+        # Scaling happens along global axes, same as the resize operator with global orientation
+        self.world = np.array(obj.matrix_world.to_3x3())
+        self.world_inv = np.linalg.inv(self.world)
+        self.pending = [] # key name, axis index and scale value of every key
+        for a in axis:
+            for j in range(len(scaling)):
+                self.pending.append(('{}--{}{}'.format(self.owner, 'pos' if j == 0 else 'neg', a[0]), a[1], scaling[j]))
+        self.keys = []
+        self.total = len(self.pending)
+        self.done = 0
+
+    def evaluate(self, count=None):
+        items = self.pending[self.done:] if count == None else self.pending[self.done:self.done + count]
+        with self.timings.stage('key evaluation'):
+            for name, axis_index, value in items:
+                scale_value = [1, 1, 1]
+                scale_value[axis_index] *= value
+                matrix = self.world_inv @ np.diag(scale_value) @ self.world
+                self.keys.append((name, (self.basis - self.pivot) @ matrix.T + self.pivot))
+        self.done += len(items)
+
+    def finished(self):
+        return self.done == self.total
+
+    def progress(self):
+        return self.done, self.total
+
+    def status(self):
+        return "{}/{} shape keys".format(self.done, self.total)
+
+    def commit(self):
+        obj = self.obj
+        with self.timings.stage('cleanup'):
+            if obj.data.shape_keys == None:
+                obj.shape_key_add(name="Basis")
+            index = ShapeKeyIndex(obj)
+            index.remove(index.owned_by([self.owner]))
+        with self.timings.stage('key writes'):
+            for name, co in self.keys:
+                key = obj.shape_key_add(name=name, from_mix=False)
+                write_shape_key_co(key, co)
+        with self.timings.stage('update'):
+            obj.data.update()
+
+    def cancel(self):
+        # Nothing gets written before commit
+        pass
+
+class GenerateObjectScaleShapekeyOperator(ChunkedGeneration, bpy.types.Operator):
+    bl_idname = 'opr.generate_object_scale_shapekeys_operator'
+    bl_label = 'Generate object scale shape keys'
+    bl_description = 'Generates shape keys for negative and positive object scaling on specified axis for a selected model'
+
+    def prepare(self, context):
+        POSITIVE_SCALING = context.scene.positive_scaling
+        NEGATIVE_SCALING = context.scene.negative_scaling
+        ENABLE_X = context.scene.enable_x
+        ENABLE_Y = context.scene.enable_y
+        ENABLE_Z = context.scene.enable_z
+        PIVOT = context.scene.object_scale_pivot
+
+        axis = []
+        if ENABLE_X: axis.append(('X', 0))
+        if ENABLE_Y: axis.append(('Y', 1))
+        if ENABLE_Z: axis.append(('Z', 2))
+        return ObjectScaleGeneration(bpy.context.active_object, axis, [POSITIVE_SCALING, NEGATIVE_SCALING], PIVOT, self.timings)
+
+    def finish(self, context, generation):
+        generation.commit()
+        return "Generated {} shape keys".format(generation.total)
+
+class GenerateControllersOperator(bpy.types.Operator):
+    bl_idname = 'opr.generate_controllers_operator'
+    bl_label = 'Create HWM controllers file using generated shape keys IDs based on a given .dmx file'
+    bl_description = 'Generates controller block containing controllers for regular shape keys, HWM (if specified) and scaling controllers '
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute (self, context):
+        global controllers_count
+        controllers_count = 0
+        DMX_FILE_PATH = bpy.path.abspath(context.scene.dmx_file_path) if context.scene.dmx_file_path != '' else ''
+        OUTPUT_PATH = bpy.path.abspath(context.scene.controller_output_path)
+        OUTPUT_ENCODING = context.scene.controller_output_encoding
+        CONTROLLER_SOURCE = context.scene.controller_source
+        CONTROLLER_OUTPUT = context.scene.controller_output
+        if CONTROLLER_SOURCE == None:
+            return {'CANCELLED'}
+        timings = StageTimings()
+        try:
+            output, controllers_count, orphans = build_controllers(CONTROLLER_SOURCE.as_string(), DMX_FILE_PATH, timings)
+        except (OSError, ValueError) as error:
+            self.report({'ERROR'}, "{}: {}".format(CONTROLLER_SOURCE.name, error))
+            return {'CANCELLED'}
+        if len(orphans) != 0:
+            self.report({'WARNING'}, "Scale keys without a --pos/--neg partner got regular controllers: {}".format(", ".join(orphans)))
+
+        print("Generated {} controllers (128 supported)".format(controllers_count))
+
+        if context.scene.controller_output_path != '':
+            try:
+                with timings.stage('write'):
+                    write_controllers(output, OUTPUT_PATH, OUTPUT_ENCODING)
+            except (OSError, ValueError, IndexError) as error:
+                self.report({'ERROR'}, "Couldn't write controllers: {}".format(error))
+                return {'CANCELLED'}
+        else:
+            if CONTROLLER_OUTPUT == None:
+                CONTROLLER_OUTPUT = bpy.data.texts.new(CONTROLLER_SOURCE.name + "-new")
+                context.scene.controller_output = CONTROLLER_OUTPUT
+            with timings.stage('write'):
+                CONTROLLER_OUTPUT.from_string(output)
+        record_timings(context, self.bl_label, timings)
+
+        return {'FINISHED'}
+
+FILTER_OUT = ["hlp_", "index", "middle", "ring", "pinky", "thumb", "weapon"]
+READY_TO_GENERATE = False
+controllers_count = 0
+last_timings = None # operator and stage timings of the last run, shown in the panel
+
+def record_timings(context, operator, timings):
+    global last_timings
+    last_timings = (operator, timings)
+    # Every run is appended to the timings file as a line of JSON
+    if context.scene.timings_path != '':
+        entry = {'operator': operator, 'time': time.time(), 'blender': bpy.app.version_string, 'stages': timings, 'total': timings.total()}
+        try:
+            with open(bpy.path.abspath(context.scene.timings_path), 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry) + '\n')
+        except OSError as error:
+            print("Couldn't write timings: {}".format(error))
+
+def check_controller_file(self, context):
+    global READY_TO_GENERATE
+    # print(context.scene.controller_source, context.scene.controller_output)
+    READY_TO_GENERATE = context.scene.controller_source != None
+
+PROPS = [
+    ('exaggeration_multiplier', bpy.props.FloatProperty(name="Exaggeration multiplier", default=10)),
+    ('exaggeration_filter', bpy.props.StringProperty(name="Filter", description="Only exaggerate shape keys matching one of these comma-separated name patterns (* and ? wildcards)")),
+    ('exaggeration_active_only', bpy.props.BoolProperty(name="Active key only", description="Only exaggerate the active shape key", default=False)),
+    ('positive_scaling', bpy.props.FloatProperty(name="Upper bound", default=5)),
+    ('negative_scaling', bpy.props.FloatProperty(name="Lower bound", default=0)),
+    ('dmx_file_path', bpy.props.StringProperty(name="Controller source", subtype="FILE_PATH")),
+    ('controller_source', bpy.props.PointerProperty(type=bpy.types.Text, name="ID source", update=check_controller_file)),
+    ('controller_output', bpy.props.PointerProperty(type=bpy.types.Text, name="Controller output")),
+    ('controller_output_path', bpy.props.StringProperty(name="Output file", description="Write the generated controllers to this file instead of a text datablock", subtype="FILE_PATH")),
+    ('controller_output_encoding', bpy.props.EnumProperty(name="Encoding", description="DMX encoding of the output file", items=[
+        ('KEYVALUES2', "Keyvalues2", "Text DMX"),
+        ('BINARY', "Binary", "Binary DMX"),
+    ])),
+    ('object_scale_pivot', bpy.props.EnumProperty(name="Pivot", description="Point object scaling shape keys are scaled around", items=[
+        ('MEDIAN', "Median point", "Scale around the mean of the basis shape vertices, like scaling the whole mesh in edit mode"),
+        ('ORIGIN', "Origin", "Scale around the object origin"),
+        ('BOUNDS', "Bounds center", "Scale around the center of the basis shape bounding box"),
+    ], default='MEDIAN')),
+    ('enable_x', bpy.props.BoolProperty(name='Enable scaling for X axis', default=True)),
+    ('enable_y', bpy.props.BoolProperty(name='Enable scaling for Y axis', default=True)),
+    ('enable_z', bpy.props.BoolProperty(name='Enable scaling for Z axis', default=True)),
+    ('empty_key_threshold', bpy.props.FloatProperty(name="Empty key threshold", description="Bone scaling shape keys that move no vertex further than this are not created", default=0.0001, min=0, precision=5)),
+    ('enable_key_merge', bpy.props.BoolProperty(name='Merge shape keys', description="Make a single set of shape keys for selected bones", default=False)),
+    ('timings_path', bpy.props.StringProperty(name="Timings file", description="Append the stage timings of every operator run to this file, one JSON object per line", subtype="FILE_PATH")),
+]     
+
+class ScaleFlexesPanel(bpy.types.Panel):
+    bl_idname = 'VIEW3D_PT_sfm_scale_flexes_panel'
+    bl_label = 'SFM bone scale flexes generator'
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+            
+    def draw(self, context):
+        selected_objects = bpy.context.selected_objects
+        OBJECT_SELECTED = len(selected_objects) != 0
+        BONE_SCALING_MODE = False        
+        if OBJECT_SELECTED:
+            active_object = bpy.context.active_object
+            OBJECT_SELECTED = active_object.type == 'MESH'
+            BONE_SCALING_MODE = active_object.type == "ARMATURE" and bpy.context.mode == 'POSE'
+        # ----------
+        box = self.layout.box()
+        box.enabled = OBJECT_SELECTED
+        box.operator('opr.crowbar_shapekey_cleaner', text='Clean up Crowbar\'s stereo shape key names')
+
+        row = box.row()
+        row.prop(context.scene, 'exaggeration_multiplier')
+        row.operator('opr.exaggerate_shapekeys_operator', text='Exaggerate shape keys')
+        row = box.row()
+        row.prop(context.scene, 'exaggeration_filter')
+        row.prop(context.scene, 'exaggeration_active_only')
+        # ----------
+        box = self.layout.box()
+        box.enabled = OBJECT_SELECTED or BONE_SCALING_MODE
+
+        row = box.row()
+        col = row.column()
+        col.prop(context.scene, 'positive_scaling')
+        col.prop(context.scene, 'negative_scaling')
+        col = row.column()
+
+        col.prop(context.scene, 'enable_x')
+        col.prop(context.scene, 'enable_y')
+        col.prop(context.scene, 'enable_z')
+
+        row = box.row()
+        col = row.column()
+        col.enabled = BONE_SCALING_MODE
+        box = col.box()
+        box.label(text="Bone scaling")
+        box.prop(context.scene, 'enable_key_merge')
+        box.prop(context.scene, 'empty_key_threshold')
+        box.operator('opr.generate_bone_scale_shapekeys_operator', text='Generate shape keys')
+        box.operator('opr.remove_bone_scale_shapekeys_operator', text='Remove shape keys')
+        col = row.column()
+        col.enabled = OBJECT_SELECTED and not BONE_SCALING_MODE
+        box = col.box()
+        box.label(text="Object scaling")
+        box.prop(context.scene, 'object_scale_pivot')
+        box.operator('opr.generate_object_scale_shapekeys_operator', text='Generate shape keys')
+        box.operator('opr.remove_object_scale_shapekeys_operator', text='Remove shape keys')
+        # ----------
+        box = self.layout.box()
+        box.prop(context.scene, 'controller_source')
+        box.prop(context.scene, 'controller_output')
+        box.prop(context.scene, 'dmx_file_path')
+        row = box.row()
+        row.prop(context.scene, 'controller_output_path')
+        row.prop(context.scene, 'controller_output_encoding', text='')
+        row = box.row()
+        row.operator('opr.generate_controllers_operator', text='Generate controllers')
+        row.enabled = READY_TO_GENERATE
+        # ----------
+        if controllers_count != 0:
+            self.layout.label(text="{} controllers generated.".format(controllers_count))
+        # ----------
+        box = self.layout.box()
+        if last_timings != None:
+            operator, timings = last_timings
+            box.label(text="{}: {:.0f} ms".format(operator, timings.total() * 1000))
+            col = box.column(align=True)
+            for stage, seconds in timings.items():
+                row = col.row()
+                row.label(text=stage)
+                row.label(text="{:.1f} ms".format(seconds * 1000))
+        box.prop(context.scene, 'timings_path')
+
+
+CLASSES = [
+    ScaleFlexesPanel,
+    CrowbarShapekeyCleanerOperator,
+    ExaggerateShapeKeysOperator,
+    GenerateBoneScaleShapeKeysOperator,
+    GenerateObjectScaleShapekeyOperator,
+    RemoveObjectScaleShapeKeysOperator,
+    RemoveBoneScaleShapeKeysOperator,
+    GenerateControllersOperator
+]
+
+def register():
+    for (prop_name, prop_value) in PROPS:
+        setattr(bpy.types.Scene, prop_name, prop_value)
+
+    for c in CLASSES:
+        bpy.utils.register_class(c)
+
+def unregister():
+    for (prop_name, _) in PROPS:
+        delattr(bpy.types.Scene, prop_name)
+        
+    for c in CLASSES:
+        bpy.utils.unregister_class(c)
+
@@ -0,0 +1,201 @@
+# Batch processing, runs without the UI:
+#   blender -b --python sfm_scale_flexes_generator/batch.py -- manifest.json [--jobs N] [--report report.json]
+# Every model of the manifest gets processed by a background Blender process of its own
+import os, sys, json, time, argparse, tempfile, traceback
+from fnmatch import fnmatchcase
+from subprocess import run, PIPE, STDOUT, TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bpy
+from sfm_scale_flexes_generator.addon import bone_scale_jobs, clean_crowbar_shape_key_names, generate_bone_scale_keys, get_deformed_meshes, unsupported_deform_settings
+from sfm_scale_flexes_generator.controllers import build_controllers, write_controllers
+
+BATCH_DEFAULTS = {
+    'name': None, # name of the model in the report, the source file name if not given
+    'source': None, # .blend file to open or .smd/.dmx file to import with Blender Source Tools
+    'output': None, # .blend file to save to, the source file name with a -flexes.blend suffix if not given
+    'crowbar_cleanup': False,
+    'armature': None, # the first armature of the scene if not given
+    'bones': [], # bone name patterns (* and ? wildcards) to generate bone scaling shape keys for
+    'axes': 'XYZ',
+    'bounds': [0, 5], # lower and upper bound of the scaling
+    'merge': False,
+    'merge_bone': None, # bone the merged keys are named after, the first matching bone if not given
+    'empty_key_threshold': 0.0001,
+    'controller_source': None, # keyvalues2 DMX holding the shape key ids
+    'hwm_source': None,
+    'controller_output': None, # the controller source name with a -controllers suffix if not given
+    'controller_encoding': 'KEYVALUES2',
+}
+BATCH_PATHS = ['source', 'output', 'controller_source', 'hwm_source', 'controller_output']
+
+def load_batch_manifest(path):
+    # Jobs of every model of the manifest, paths are relative to the manifest
+    with open(path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    root = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for model in manifest.get('models', []):
+        job = dict(BATCH_DEFAULTS)
+        job.update(manifest.get('defaults', {}))
+        job.update(model)
+        unknown = [key for key in job if key not in BATCH_DEFAULTS]
+        if len(unknown) != 0:
+            raise ValueError("Unknown manifest keys: {}".format(", ".join(unknown)))
+        if job['source'] == None:
+            raise ValueError("Model without a source in {}".format(path))
+        for key in BATCH_PATHS:
+            if job[key] != None:
+                job[key] = os.path.join(root, job[key])
+        if job['name'] == None:
+            job['name'] = os.path.basename(job['source'])
+        jobs.append(job)
+    return manifest, jobs
+
+def run_batch_model(job):
+    # Processes a single model in the running Blender instance, returns its report entry
+    timings = {}
+    result = {'name': job['name'], 'status': 'ok', 'timings': timings}
+
+    start = time.perf_counter()
+    if os.path.splitext(job['source'])[1].lower() == '.blend':
+        bpy.ops.wm.open_mainfile(filepath=job['source'])
+    else:
+        bpy.ops.wm.read_homefile(use_empty=True)
+        bpy.ops.import_scene.smd(filepath=job['source'])
+    # Sources are never saved over unless the output says so
+    output = job['output'] or os.path.splitext(job['source'])[0] + '-flexes.blend'
+    objects = bpy.context.view_layer.objects
+    timings['load'] = time.perf_counter() - start
+    modified = False
+
+    if job['crowbar_cleanup']:
+        start = time.perf_counter()
+        for obj in objects:
+            if obj.type == 'MESH' and obj.data.shape_keys != None:
+                conflicts = clean_crowbar_shape_key_names(obj)
+                if len(conflicts) != 0:
+                    result.setdefault('crowbar_conflicts', {})[obj.name] = conflicts
+        timings['crowbar_cleanup'] = time.perf_counter() - start
+        modified = True
+
+    if len(job['bones']) != 0:
+        start = time.perf_counter()
+        armatures = [obj for obj in objects if obj.type == 'ARMATURE' and (job['armature'] == None or obj.name == job['armature'])]
+        if len(armatures) == 0:
+            raise ValueError("No armature {}".format(job['armature'] or "in the scene"))
+        arm = armatures[0]
+        bone_names = [bone.name for bone in arm.pose.bones if any(fnmatchcase(bone.name, pattern) for pattern in job['bones'])]
+        if len(bone_names) == 0:
+            raise ValueError("No bone of {} matches {}".format(arm.name, ", ".join(job['bones'])))
+        meshes = get_deformed_meshes(arm, objects)
+        unsupported = unsupported_deform_settings(meshes, arm)
+        if len(unsupported) != 0:
+            raise ValueError("Armature settings that scale keys can't be generated with: {}".format(", ".join(unsupported)))
+        axis = [(a, 'XYZ'.index(a)) for a in 'XYZ' if a in job['axes'].upper()]
+        lower, upper = job['bounds']
+        key_owners, jobs = bone_scale_jobs(bone_names, job['merge_bone'] or bone_names[0], axis, [upper, lower], job['merge'])
+        generated, skipped, pruned, pruned_bytes, saved_controllers = generate_bone_scale_keys(arm, meshes, key_owners, jobs, job['empty_key_threshold'])
+        result.update(meshes=len(meshes), bones=len(bone_names), generated=generated, skipped=skipped, pruned=pruned, saved_controllers=saved_controllers)
+        timings['bone_scaling'] = time.perf_counter() - start
+        modified = True
+
+    if modified:
+        start = time.perf_counter()
+        bpy.ops.wm.save_as_mainfile(filepath=output)
+        result['output'] = output
+        timings['save'] = time.perf_counter() - start
+
+    if job['controller_source'] != None:
+        start = time.perf_counter()
+        with open(job['controller_source'], encoding='utf-8') as file:
+            source = file.read()
+        controllers, count, orphans = build_controllers(source, job['hwm_source'] or '')
+        controller_output = job['controller_output'] or os.path.splitext(job['controller_source'])[0] + '-controllers.dmx'
+        write_controllers(controllers, controller_output, job['controller_encoding'])
+        result.update(controllers=count, orphans=orphans, controller_output=controller_output)
+        timings['controllers'] = time.perf_counter() - start
+
+    return result
+
+def batch_worker(job_path, result_path):
+    with open(job_path, encoding='utf-8') as file:
+        job = json.load(file)
+    try:
+        result = run_batch_model(job)
+    except Exception as error:
+        traceback.print_exc()
+        result = {'name': job['name'], 'status': 'failed', 'error': "{}: {}".format(type(error).__name__, error)}
+    with open(result_path, 'w', encoding='utf-8') as file:
+        json.dump(result, file)
+    return 0 if result['status'] == 'ok' else 1
+
+def run_batch(manifest_path, concurrency=None, report_path=None, timeout=None):
+    # Hands the models out to a pool of background Blender processes and collects their results
+    manifest, jobs = load_batch_manifest(manifest_path)
+    concurrency = concurrency or manifest.get('jobs') or os.cpu_count() or 1
+    script = os.path.abspath(__file__)
+    batch_start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        def process(index):
+            job_path = os.path.join(workdir, 'job{}.json'.format(index))
+            result_path = os.path.join(workdir, 'result{}.json'.format(index))
+            with open(job_path, 'w', encoding='utf-8') as file:
+                json.dump(jobs[index], file)
+            start = time.perf_counter()
+            try:
+                worker = run([bpy.app.binary_path, '-b', '--python-exit-code', '1', '--python', script, '--', '--worker', job_path, result_path], stdout=PIPE, stderr=STDOUT, timeout=timeout)
+                log = worker.stdout.decode('utf-8', 'replace').splitlines()
+                if os.path.exists(result_path):
+                    with open(result_path, encoding='utf-8') as file:
+                        result = json.load(file)
+                else:
+                    result = {'name': jobs[index]['name'], 'status': 'failed', 'error': "Blender exited with code {}".format(worker.returncode)}
+                if result['status'] != 'ok':
+                    result['log'] = log[-20:]
+            except TimeoutExpired:
+                result = {'name': jobs[index]['name'], 'status': 'failed', 'error': "Timed out after {} seconds".format(timeout)}
+            result['wall_time'] = time.perf_counter() - start
+            print("[{}/{}] {} {} in {:.1f}s".format(index + 1, len(jobs), result['name'], result['status'], result['wall_time']), flush=True)
+            return result
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(process, range(len(jobs))))
+
+    failed = len([result for result in results if result['status'] != 'ok'])
+    report = {
+        'manifest': os.path.abspath(manifest_path),
+        'concurrency': concurrency,
+        'wall_time': time.perf_counter() - batch_start,
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'models': results,
+    }
+    report_path = report_path or os.path.splitext(manifest_path)[0] + '-report.json'
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=4)
+    print("Processed {} models, {} failed, in {:.1f}s. Report written to {}".format(len(results), failed, report['wall_time'], report_path))
+    return report
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog='blender -b --python sfm_scale_flexes_generator/batch.py --', description="Process the models of a JSON manifest in parallel background Blender processes")
+    parser.add_argument('manifest', nargs='?', help="JSON manifest listing the models to process")
+    parser.add_argument('-j', '--jobs', type=int, help="number of Blender processes to run at once, the manifest's 'jobs' or the CPU count by default")
+    parser.add_argument('--report', help="JSON report to write, next to the manifest by default")
+    parser.add_argument('--timeout', type=float, help="seconds after which a model is considered failed")
+    parser.add_argument('--worker', nargs=2, metavar=('JOB', 'RESULT'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.worker != None:
+        return batch_worker(*args.worker)
+    if args.manifest == None:
+        parser.error("a manifest is required")
+    try:
+        report = run_batch(args.manifest, args.jobs, args.report, args.timeout)
+    except (OSError, ValueError) as error:
+        print("Error: {}".format(error))
+        return 2
+    return 0 if report['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(batch_main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []))
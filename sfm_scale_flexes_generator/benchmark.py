@@ -0,0 +1,186 @@
+# Benchmark suite, runs without the UI:
+#   blender -b --factory-startup --python sfm_scale_flexes_generator/benchmark.py -- [--vertices N] [--bones N] [--keys N] [--controls N] [--repeat N] [--output results.json]
+# Every repeat builds the same synthetic rig from scratch and runs each operator on it once.
+# The wall time and the stage timings the operators record are written as JSON
+import os, sys, json, time, argparse, platform, statistics, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bpy
+import numpy as np
+from sfm_scale_flexes_generator import addon
+
+def build_rig(vertices, bones, keys, seed):
+    # A chain of bones along Z and a point cloud around it, every vertex weighted to the two
+    # closest bones, with Crowbar named stereo shape keys moving a tenth of the vertices each
+    rng = np.random.default_rng(seed)
+    bpy.ops.wm.read_homefile(use_empty=True)
+    scene = bpy.context.scene
+
+    arm = bpy.data.objects.new('rig', bpy.data.armatures.new('rig'))
+    scene.collection.objects.link(arm)
+    bpy.context.view_layer.objects.active = arm
+    bpy.ops.object.mode_set(mode='EDIT')
+    parent = None
+    for i in range(bones):
+        bone = arm.data.edit_bones.new('bone_{}'.format(i))
+        bone.head = (0, 0, i)
+        bone.tail = (0, 0, i + 1)
+        bone.parent = parent
+        parent = bone
+    bpy.ops.object.mode_set(mode='OBJECT')
+    for bone in arm.data.bones:
+        bone.select = True
+    arm.data.bones.active = arm.data.bones[0]
+
+    co = np.column_stack((rng.normal(0, 0.5, vertices), rng.normal(0, 0.5, vertices), rng.uniform(0, bones, vertices)))
+    mesh = bpy.data.meshes.new('body')
+    mesh.vertices.add(vertices)
+    mesh.vertices.foreach_set('co', co.astype(np.float32).ravel())
+    obj = bpy.data.objects.new('body', mesh)
+    scene.collection.objects.link(obj)
+    obj.parent = arm
+    obj.modifiers.new('Armature', 'ARMATURE').object = arm
+
+    # Weights are rounded to tenths so every group is filled with a handful of calls
+    lower = np.minimum(co[:, 2].astype(int), bones - 1)
+    weight = np.round(co[:, 2] - lower, 1)
+    groups = [obj.vertex_groups.new(name=bone.name) for bone in arm.data.bones]
+    for level in np.unique(weight):
+        for index in range(bones):
+            below = np.flatnonzero((lower == index) & (weight == level))
+            above = np.flatnonzero((lower == index - 1) & (weight == level))
+            if len(below) != 0 and level < 1:
+                groups[index].add(below.tolist(), 1 - float(level), 'REPLACE')
+            if len(above) != 0 and level > 0:
+                groups[index].add(above.tolist(), float(level), 'REPLACE')
+
+    obj.shape_key_add(name='Basis')
+    for i in range(keys):
+        key = obj.shape_key_add(name='flex{}L+flex{}R'.format(i, i), from_mix=False)
+        moved = rng.choice(vertices, max(vertices // 10, 1), replace=False)
+        key_co = co.copy()
+        key_co[moved] += rng.normal(0, 0.01, (len(moved), 3))
+        addon.write_shape_key_co(key, key_co)
+    return arm, obj
+
+def dmx_controls(names, hwm=False):
+    # keyvalues2 DMX with a control per name, HWM controls drive two keys each
+    controls = []
+    for i in range(0, len(names), 2 if hwm else 1):
+        raw_names = names[i:i + 2] if hwm else names[i:i + 1]
+        controls.append('''			"DmeCombinationInputControl"
+			{{
+				"id" "elementid" "{:08x}-0000-0000-0000-000000000000"
+				"name" "string" "{}"
+				"rawControlNames" "string_array" [ {} ]
+				"stereo" "bool" "0"
+				"eyelid" "bool" "0"
+				"wrinkleScales" "float_array" [ {} ]
+			}},
+'''.format(i, raw_names[0], ', '.join('"{}"'.format(name) for name in raw_names), ', '.join('"0"' for name in raw_names)))
+    return '''<!-- dmx encoding keyvalues2 1 format model 1 -->
+"DmElement"
+{
+	"id" "elementid" "ffffffff-0000-0000-0000-000000000000"
+	"name" "string" "root"
+	"combinationOperator" "DmeCombinationOperator"
+	{
+		"id" "elementid" "eeeeeeee-0000-0000-0000-000000000000"
+		"controls" "element_array"
+		[
+''' + ''.join(controls) + '''		]
+		"controlValues" "vector3_array" [ ]
+	}
+}
+'''
+
+def run_operator(name, operator, **context):
+    start = time.perf_counter()
+    with bpy.context.temp_override(**context):
+        result = operator()
+    wall = time.perf_counter() - start
+    if result != {'FINISHED'}:
+        raise RuntimeError("{} returned {}".format(name, result))
+    label, timings = addon.last_timings
+    return {'wall': wall, 'stages': dict(timings), 'total': timings.total()}
+
+def run_benchmark(args, workdir):
+    runs = {}
+    for repeat in range(args.repeat):
+        arm, obj = build_rig(args.vertices, args.bones, args.keys, args.seed)
+        scene = bpy.context.scene
+        pose_bones = list(arm.pose.bones)
+        bone_context = {'active_object': arm, 'object': arm, 'selected_pose_bones': pose_bones, 'active_bone': arm.data.bones.active}
+        mesh_context = {'active_object': obj, 'object': obj}
+
+        def record(name, operator, **context):
+            runs.setdefault(name, []).append(run_operator(name, operator, **context))
+            print("[{}/{}] {}: {:.3f}s".format(repeat + 1, args.repeat, name, runs[name][-1]['wall']), flush=True)
+
+        record('crowbar_cleanup', bpy.ops.opr.crowbar_shapekey_cleaner, **mesh_context)
+        record('exaggerate', bpy.ops.opr.exaggerate_shapekeys_operator, **mesh_context)
+        scene.enable_key_merge = False
+        record('bone_scale_generate', bpy.ops.opr.generate_bone_scale_shapekeys_operator, **bone_context)
+        record('bone_scale_regenerate', bpy.ops.opr.generate_bone_scale_shapekeys_operator, **bone_context)
+        key_names = [key.name for key in obj.data.shape_keys.key_blocks[1:]]
+        record('bone_scale_remove', bpy.ops.opr.remove_bone_scale_shapekeys_operator, **bone_context)
+        scene.enable_key_merge = True
+        record('bone_scale_generate_merged', bpy.ops.opr.generate_bone_scale_shapekeys_operator, **bone_context)
+        record('bone_scale_remove_merged', bpy.ops.opr.remove_bone_scale_shapekeys_operator, **bone_context)
+        record('object_scale_generate', bpy.ops.opr.generate_object_scale_shapekeys_operator, **mesh_context)
+        record('object_scale_remove', bpy.ops.opr.remove_object_scale_shapekeys_operator, **mesh_context)
+
+        # The controller source lists the keys of the rig, padded with extra controls
+        names = key_names + ['control{}'.format(i) for i in range(max(args.controls - len(key_names), 0))]
+        hwm_path = os.path.join(workdir, 'hwm.dmx')
+        with open(hwm_path, 'w', encoding='utf-8') as file:
+            file.write(dmx_controls(names[:len(names) // 4], hwm=True))
+        source = bpy.data.texts.new('controls.dmx')
+        source.from_string(dmx_controls(names))
+        scene.controller_source = source
+        scene.dmx_file_path = hwm_path
+        for encoding in ['KEYVALUES2', 'BINARY']:
+            scene.controller_output_path = os.path.join(workdir, 'controllers-{}.dmx'.format(encoding.lower()))
+            scene.controller_output_encoding = encoding
+            record('controllers_' + encoding.lower(), bpy.ops.opr.generate_controllers_operator)
+    return runs
+
+def benchmark_main(argv):
+    parser = argparse.ArgumentParser(prog='blender -b --factory-startup --python sfm_scale_flexes_generator/benchmark.py --', description="Time every operator on synthetic rigs")
+    parser.add_argument('--vertices', type=int, default=20000, help="vertex count of the synthetic mesh")
+    parser.add_argument('--bones', type=int, default=16, help="bone count of the synthetic armature")
+    parser.add_argument('--keys', type=int, default=32, help="shape key count of the synthetic mesh")
+    parser.add_argument('--controls', type=int, default=2000, help="control count of the synthetic controller source")
+    parser.add_argument('--repeat', type=int, default=3, help="number of times every operator runs, each on a fresh rig")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic rig")
+    parser.add_argument('--output', help="JSON file to write the results to, printed if not given")
+    args = parser.parse_args(argv)
+
+    addon.register()
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = run_benchmark(args, workdir)
+
+    results = {
+        'blender': bpy.app.version_string,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'parameters': vars(args),
+        'operators': {},
+    }
+    for name, operator_runs in runs.items():
+        walls = [run['wall'] for run in operator_runs]
+        results['operators'][name] = {'min': min(walls), 'median': statistics.median(walls), 'runs': operator_runs}
+
+    print("{:<28} {:>10} {:>10}".format("operator", "min (ms)", "median (ms)"))
+    for name, result in results['operators'].items():
+        print("{:<28} {:>10.1f} {:>10.1f}".format(name, result['min'] * 1000, result['median'] * 1000))
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=4)
+        print("Results written to {}".format(args.output))
+    else:
+        print(json.dumps(results, indent=4))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(benchmark_main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []))
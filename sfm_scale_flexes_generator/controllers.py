@@ -0,0 +1,163 @@
+import argparse, os, sys
+from .dmx import DMX_HEADER, KeyValues2Reader, open_dmx, write_binary_dmx
+from .shape_keys import SCALE_KEY
+from .timings import StageTimings
+
+def parse_dmx_controllers(DMX_FILE_PATH):
+    with open_dmx(DMX_FILE_PATH) as dmx:
+        return list(dmx.iter_elements('DmeCombinationInputControl'))
+
+def build_controllers(source, hwm_path='', timings=None):
+    # Controller block for every shape key of a keyvalues2 DMX source, reusing the controllers
+    # of the HWM source if given. Returns the DMX text, the controller count and the scale keys
+    # that got regular controllers because their pair is missing
+    timings = timings if timings != None else StageTimings()
+    # Fail if the source file isn't a dmx controller list
+    if not source.startswith('<!-- dmx encoding keyvalues2'):
+        raise ValueError("not a keyvalues2 DMX file")
+
+    with timings.stage('parse'):
+        # The output is the source up to the opening bracket of the controls array, followed by
+        # the new controllers
+        data = source.encode('utf-8')
+        reader = KeyValues2Reader(data)
+        offset = reader.attribute_offset('DmeCombinationOperator', 'controls')
+        if offset == None:
+            raise ValueError("no DmeCombinationOperator controls")
+        reader.pos = offset
+        if reader.token() != b'[':
+            reader.error("'[' expected", offset)
+        header = data[:reader.pos].decode('utf-8') + "\n"
+        # Get shape key ids, in source order
+        controller_ids = {}
+        for control in reader.iter_elements('DmeCombinationInputControl'):
+            controller_ids[control['name'][1]] = control.id
+        # If present, parse HWM controllers
+        hwm_controls = parse_dmx_controllers(hwm_path) if hwm_path != '' else []
+    with timings.stage('build'):
+        return format_controllers(header, controller_ids, hwm_controls)
+
+def format_controllers(header, controller_ids, hwm_controls):
+    count = 0
+
+    # The controller file is assembled in a single buffer and committed in one write
+    out = [header]
+
+    claimed = set() # keys that already have a controller
+
+    # HWM controllers first
+    for c in hwm_controls:
+        raw_names = c['rawControlNames'][1] if 'rawControlNames' in c else []
+        if len(raw_names) == 0:
+            continue
+        name = raw_names[0]
+        if name in controller_ids and name not in claimed:
+            claimed.update(control for control in raw_names if control in controller_ids)
+            # write controller
+            out.append('\t\t\t"DmeCombinationInputControl"\n\t\t\t{\n')
+            c['id'][1] = controller_ids[name]
+            for key in c.keys():
+                out.append('\t\t\t\t"{}" "{}"'.format( key, c[key][0]))
+                if "array" not in c[key][0]:
+                    out.append(' "{}"\n'.format(c[key][1]))
+                else:
+                    out.append('\n\t\t\t\t[\n')
+                    for i in range(len(c[key][1])):
+                        out.append('\t\t\t\t\t"{}"'.format(c[key][1][i]))
+                        out.append(',\n' if i+1 != len(c[key][1]) else '')
+                    out.append('\n\t\t\t\t]\n')
+            out.append("\t\t\t},\n")
+            count += 1
+
+    # Parse scale controllers
+    orphans = []
+    for key in controller_ids:
+        match = SCALE_KEY.match(key)
+        if key in claimed or match is None:
+            continue
+        base, direction, axis = match.groups()
+        pair = '{}--{}{}'.format(base, 'pos' if direction == 'neg' else 'neg', axis)
+        if pair not in controller_ids or pair in claimed:
+            orphans.append(key)
+            continue
+        if direction == 'pos':
+            continue
+        claimed.update((key, pair))
+        out.append("\t"*3 + '"DmeCombinationInputControl"\n')
+        out.append("\t"*3 + "{\n" )
+        out.append("\t"*4 + '"id" "elementid" "{}"\n'.format(controller_ids[key]))
+        out.append("\t"*4 + '"name" "string" "{}--scale{}"\n'.format(base, axis))
+        out.append("\t"*4 + '"rawControlNames" "string_array"\n')
+        out.append("\t"*4 + "[\n")
+        out.append("\t"*5 + '"{}",\n'.format(key))
+        out.append("\t"*5 + '"{}"\n'.format(pair))
+        out.append("\t"*4 + "]\n")
+        out.append("\t"*4 + '"stereo" "bool" "0"\n')
+        out.append("\t"*4 + '"eyelid" "bool" "0"\n')
+        out.append("\t"*4 + '"wrinkleScales" "float_array"\n')
+        out.append("\t"*4 + '[\n')
+        out.append("\t"*5 + '"0",\n')
+        out.append("\t"*5 + '"0"\n')
+        out.append("\t"*4 + ']\n')
+        out.append("\t"*3 + '},\n')
+        count += 1
+
+    # Generate controllers for the remaining keys
+    for key in controller_ids:
+        if key in claimed:
+            continue
+        out.append("\t"*3 + '"DmeCombinationInputControl"\n')
+        out.append("\t"*3 + "{\n" )
+        out.append("\t"*4 + '"id" "elementid" "{}"\n'.format(controller_ids[key]))
+        out.append("\t"*4 + '"name" "string" "{}"\n'.format(key))
+        out.append("\t"*4 + '"rawControlNames" "string_array" ["{}"]\n'.format(key))
+        out.append("\t"*4 + '"stereo" "bool" "0"\n')
+        out.append("\t"*4 + '"eyelid" "bool" "0"\n')
+        out.append("\t"*4 + '"wrinkleScales" "float_array" ["0.0"]\n')
+        out.append("\t"*3 + "},\n" )
+        count += 1
+
+    # Write controller file footer
+    out.append("\t\t]\n")
+    values = ', '.join(['"0.0 0.0 0.5"'] * count)
+    out.append('\t\t"controlValues" "vector3_array" [' + values + ']\n')
+    out.append('\t\t"controlValuesLagged" "vector3_array" [' + values + ']\n')
+    out.append("\t\t" + '"usesLaggedValues" "bool" "0"\n')
+    out.append("\t\t" + '"dominators" "element_array" [ ]\n')
+    out.append("\t\t" + '"targets" "element_array" [ ]\n')
+    out.append("\t}\n")
+    out.append("}\n")
+    return ''.join(out), count, orphans
+
+def write_controllers(output, path, encoding='KEYVALUES2'):
+    # Write straight to disk, without keeping the controllers in the .blend file
+    if encoding == 'BINARY':
+        header = DMX_HEADER.match(output.encode('utf-8'))
+        root = KeyValues2Reader(output.encode('utf-8')).roots()[0]
+        with open(path, 'wb') as file:
+            write_binary_dmx(file, root, header.group(3).decode() if header else 'model', int(header.group(4)) if header else 1)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='\n') as file:
+            file.write(output)
+
+def main(argv):
+    # Standalone controller generation: python -m sfm_scale_flexes_generator source.dmx
+    parser = argparse.ArgumentParser(prog='python -m sfm_scale_flexes_generator', description="Generate the controllers of the shape keys of a keyvalues2 DMX file")
+    parser.add_argument('source', help="keyvalues2 DMX holding the shape key ids")
+    parser.add_argument('-o', '--output', help="controller file to write, the source name with a -controllers suffix by default")
+    parser.add_argument('--hwm', default='', help="DMX file to take the HWM controllers from")
+    parser.add_argument('--encoding', choices=['keyvalues2', 'binary'], default='keyvalues2', help="DMX encoding of the output file")
+    args = parser.parse_args(argv)
+    output_path = args.output or os.path.splitext(args.source)[0] + '-controllers.dmx'
+    try:
+        with open(args.source, encoding='utf-8') as file:
+            source = file.read()
+        output, count, orphans = build_controllers(source, args.hwm)
+        write_controllers(output, output_path, args.encoding.upper())
+    except (OSError, ValueError, IndexError) as error:
+        print("Error: {}".format(error), file=sys.stderr)
+        return 1
+    if len(orphans) != 0:
+        print("Scale keys without a --pos/--neg partner got regular controllers: {}".format(", ".join(orphans)), file=sys.stderr)
+    print("Generated {} controllers (128 supported) in {}".format(count, output_path))
+    return 0
@@ -0,0 +1,534 @@
+import os, mmap, math, re, struct, uuid
+from decimal import Decimal
+
+# Tokens of the keyvalues2 DMX text format. Whitespace, commas and comments are skipped,
+# quoted strings are captured by the first group and brackets by the second one. Every repetition
+# of the skipped part starts with a comment, so a run of whitespace can only be matched one way and
+# a bad character fails right away instead of backtracking over every split of the run
+KV2_TOKEN = re.compile(rb'[\s,]*(?:(?://[^\n]*|<!--.*?-->)[\s,]*)*(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([{}\[\]])|\Z)', re.S)
+KV2_STRING = re.compile(rb'"([^"\\]*(?:\\.[^"\\]*)*)"')
+KV2_STRING_ARRAY = re.compile(rb'[\s,]*\[((?:[\s,]*"[^"\\]*(?:\\.[^"\\]*)*")*)[\s,]*\]')
+KV2_ESCAPE = re.compile(r'\\(.)', re.S)
+KV2_ESCAPES = {'n': '\n', 't': '\t', 'v': '\v', 'b': '\b', 'r': '\r', 'f': '\f', 'a': '\a'}
+
+def kv2_unescape(raw):
+    text = raw.decode('utf-8')
+    if '\\' in text:
+        text = KV2_ESCAPE.sub(lambda match: KV2_ESCAPES.get(match.group(1), match.group(1)), text)
+    return text
+
+def drain(generator):
+    # Runs a generator to completion, returning its return value
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+class DmxElement(dict):
+    # Attributes of a DMX element, mapping attribute names to [type, value] pairs.
+    # Values of element attributes are nested DmxElements or element ids
+    def __init__(self, type, offset):
+        super().__init__()
+        self.type = type
+        self.offset = offset
+
+    @property
+    def id(self):
+        return self['id'][1] if 'id' in self else None
+
+class AttributeFound(Exception):
+    def __init__(self, offset):
+        self.offset = offset
+
+class KeyValues2Reader:
+    # Streaming parser for keyvalues2 DMX text, reading from bytes or a memory-mapped file
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.file = None
+        self.index = None
+        self.watched = None # element type and attribute name attribute_offset looks for
+
+    @classmethod
+    def open(cls, path):
+        file = open(path, 'rb')
+        if os.fstat(file.fileno()).st_size == 0:
+            reader = cls(b'')
+        else:
+            reader = cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        reader.file = file
+        return reader
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_elements(self, type_name=None):
+        # Yields elements of the given type (or every element) as soon as they are closed,
+        # elements of other types are walked through without being kept
+        return self.walk(0, type_name, type_name is None)
+
+    def build_index(self):
+        # Maps element ids to the types and offsets of their elements
+        if self.index is None:
+            self.index = {}
+            drain(self.walk(0, None, False, self.index))
+        return self.index
+
+    def element(self, element_id):
+        element_type, offset = self.build_index()[element_id]
+        self.pos = offset
+        self.string()
+        self.token()
+        return drain(self.read_element(element_type, offset, None, True, None))
+
+    def attribute_offset(self, element_type, name):
+        # Offset where the value of the first attribute with the given name of an element of the
+        # given type starts, None if there's none. Parsing stops there
+        self.watched = (element_type, name)
+        try:
+            drain(self.walk(0, None, False))
+        except AttributeFound as found:
+            return found.offset
+        finally:
+            self.watched = None
+        return None
+
+    def roots(self):
+        # Fully parsed top level elements
+        return drain(self.walk(0, None, True))
+
+    def walk(self, offset, type_name, keep, index=None):
+        self.pos = offset
+        roots = []
+        while True:
+            start = self.pos
+            token = self.token()
+            if token is None:
+                return roots
+            if not isinstance(token, str) or self.token() != b'{':
+                self.error("element expected", start)
+            roots.append((yield from self.read_element(token, start, type_name, keep, index)))
+
+    def token(self):
+        # Quoted strings are returned as str, brackets as bytes and the end of data as None
+        match = KV2_TOKEN.match(self.data, self.pos)
+        if match is None:
+            self.error("unexpected character")
+        self.pos = match.end()
+        if match.group(1) is not None:
+            return kv2_unescape(match.group(1))
+        return match.group(2)
+
+    def string(self):
+        start = self.pos
+        token = self.token()
+        if not isinstance(token, str):
+            self.error("string expected", start)
+        return token
+
+    def error(self, message, pos=None):
+        raise ValueError("Invalid keyvalues2 DMX: {} at offset {}".format(message, self.pos if pos is None else pos))
+
+    def read_element(self, element_type, offset, type_name, keep, index):
+        keep = keep or element_type == type_name
+        element = DmxElement(element_type, offset) if keep else None
+        while True:
+            start = self.pos
+            name = self.token()
+            if name == b'}':
+                break
+            if not isinstance(name, str):
+                self.error("attribute name expected", start)
+            type_start = self.pos
+            attr_type = self.string()
+            if self.watched == (element_type, name):
+                raise AttributeFound(self.pos)
+            if attr_type == 'element_array':
+                value = yield from self.read_element_array(type_name, keep, index)
+            elif attr_type.endswith('_array'):
+                value = self.read_array(keep)
+            else:
+                start = self.pos
+                value = self.token()
+                if value == b'{':
+                    value = yield from self.read_element(attr_type, type_start, type_name, keep, index)
+                elif not isinstance(value, str):
+                    self.error("attribute value expected", start)
+            if name == 'id' and index is not None:
+                index[value] = (element_type, offset)
+            if keep:
+                element[name] = [attr_type, value]
+        if element_type == type_name or (type_name is None and keep):
+            yield element
+        return element
+
+    def read_element_array(self, type_name, keep, index):
+        start = self.pos
+        if self.token() != b'[':
+            self.error("'[' expected", start)
+        items = [] if keep else None
+        while True:
+            start = self.pos
+            token = self.token()
+            if token == b']':
+                return items
+            if not isinstance(token, str):
+                self.error("element expected", start)
+            value_start = self.pos
+            value = self.token()
+            if value == b'{':
+                value = yield from self.read_element(token, start, type_name, keep, index)
+            elif not isinstance(value, str):
+                self.error("element id expected", value_start)
+            if keep:
+                items.append(value)
+
+    def read_array(self, keep):
+        # Plain arrays (vertex data and the like) are matched in one go instead of token by token
+        match = KV2_STRING_ARRAY.match(self.data, self.pos)
+        if match is not None:
+            self.pos = match.end()
+            return [kv2_unescape(raw) for raw in KV2_STRING.findall(match.group(1))] if keep else None
+        start = self.pos
+        if self.token() != b'[':
+            self.error("'[' expected", start)
+        items = [] if keep else None
+        while True:
+            start = self.pos
+            token = self.token()
+            if token == b']':
+                return items
+            if not isinstance(token, str):
+                self.error("array value expected", start)
+            if keep:
+                items.append(token)
+
+DMX_HEADER = re.compile(rb'<!--\s*dmx\s+encoding\s+(\S+)\s+(\d+)\s+format\s+(\S+)\s+(\d+)\s*-->')
+
+# Binary DMX attribute types by id: keyvalues2 type name, size and struct format.
+# Array types use the same ids offset by DMX_ARRAY_OFFSET
+DMX_BINARY_TYPES = {
+    1: ('element', 4, '<i'),
+    2: ('int', 4, '<i'),
+    3: ('float', 4, '<f'),
+    4: ('bool', 1, '<B'),
+    5: ('string', None, None),
+    6: ('binary', None, None),
+    7: ('time', 4, '<i'),
+    8: ('color', 4, '<4B'),
+    9: ('vector2', 8, '<2f'),
+    10: ('vector3', 12, '<3f'),
+    11: ('vector4', 16, '<4f'),
+    12: ('qangle', 12, '<3f'),
+    13: ('quaternion', 16, '<4f'),
+    14: ('vmatrix', 64, '<16f'),
+}
+DMX_BINARY_TYPE_IDS = {type_name: type_id for type_id, (type_name, _, _) in DMX_BINARY_TYPES.items()}
+DMX_ARRAY_OFFSET = 14
+
+def format_dmx_float(value):
+    # Shortest positional text reading back as the same 32-bit float
+    value = struct.unpack('<f', struct.pack('<f', value))[0]
+    if not math.isfinite(value):
+        return repr(value)
+    for digits in range(1, 10):
+        text = '{:.{}g}'.format(value, digits)
+        if struct.unpack('<f', struct.pack('<f', float(text)))[0] == value:
+            break
+    text = '{:f}'.format(Decimal(text))
+    return text.rstrip('0').rstrip('.') if '.' in text else text
+
+def format_dmx_value(type_name, value):
+    # Converts a decoded binary value to its keyvalues2 text form
+    if type_name in ('int', 'string'):
+        return str(value)
+    if type_name == 'bool':
+        return '1' if value else '0'
+    if type_name == 'float':
+        return format_dmx_float(value)
+    if type_name == 'time':
+        return format_dmx_float(value / 10000)
+    if type_name == 'binary':
+        return value.hex().upper()
+    if type_name == 'color':
+        return ' '.join(str(component) for component in value)
+    return ' '.join(format_dmx_float(component) for component in value)
+
+def open_dmx(path):
+    # Opens a DMX file with the reader matching its encoding
+    reader = KeyValues2Reader.open(path)
+    match = DMX_HEADER.match(reader.data, 0, 256)
+    if match is not None and match.group(1) in (b'binary', b'unicode_binary'):
+        binary = BinaryDmxReader(reader.data)
+        binary.file = reader.file
+        return binary
+    return reader
+
+class BinaryDmxReader:
+    # Reader for binary DMX (encoding versions 2 to 5). Element headers are read up front,
+    # attribute values only get decoded for the elements that are asked for
+
+    def __init__(self, data):
+        self.data = data
+        self.file = None
+        match = DMX_HEADER.match(data, 0, 256)
+        if match is None or match.group(1) not in (b'binary', b'unicode_binary'):
+            raise ValueError("Invalid binary DMX: missing header")
+        self.version = int(match.group(2))
+        if not 2 <= self.version <= 5:
+            raise ValueError("Unsupported binary DMX encoding version {}".format(self.version))
+        self.pos = match.end()
+        if data[self.pos:self.pos + 1] == b'\n':
+            self.pos += 1
+        if data[self.pos:self.pos + 1] == b'\0':
+            self.pos += 1
+        self.string_index = '<i' if self.version >= 5 else '<h'
+
+        string_count = self.unpack('<i' if self.version >= 4 else '<h')
+        self.strings = [self.read_string() for _ in range(string_count)]
+        element_count = self.read_count()
+        self.types = []
+        self.names = []
+        self.ids = []
+        for _ in range(element_count):
+            self.types.append(self.read_string_ref())
+            self.names.append(self.read_string_ref() if self.version >= 4 else self.read_string())
+            self.ids.append(str(uuid.UUID(bytes_le=self.unpack('16s'))))
+        # Offsets of the attributes of every element, known once they have been walked through
+        self.offsets = [self.pos]
+        self.index = None
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_elements(self, type_name=None):
+        for i in range(len(self.types)):
+            if type_name is None or self.types[i] == type_name:
+                yield self.element_at(i)
+
+    def build_index(self):
+        if self.index is None:
+            self.index = {element_id: (self.types[i], i) for i, element_id in enumerate(self.ids)}
+        return self.index
+
+    def element(self, element_id):
+        return self.element_at(self.build_index()[element_id][1])
+
+    def element_at(self, i):
+        # Skips over the attributes of the preceding elements without decoding them
+        while len(self.offsets) <= i:
+            self.pos = self.offsets[-1]
+            for _ in range(self.read_count()):
+                self.read_attribute(False)
+            self.offsets.append(self.pos)
+        self.pos = self.offsets[i]
+        element = DmxElement(self.types[i], i)
+        element['id'] = ['elementid', self.ids[i]]
+        element['name'] = ['string', self.names[i]]
+        for _ in range(self.read_count()):
+            name, attr_type, value = self.read_attribute(True)
+            element[name] = [attr_type, value]
+        if len(self.offsets) == i + 1:
+            self.offsets.append(self.pos)
+        return element
+
+    def error(self, message, pos=None):
+        raise ValueError("Invalid binary DMX: {} at offset {}".format(message, self.pos if pos is None else pos))
+
+    def unpack(self, format):
+        # Truncated files run out of data here, corrupt ones mostly end up pointing past the end
+        try:
+            value = struct.unpack_from(format, self.data, self.pos)
+        except struct.error:
+            self.error("unexpected end of data")
+        self.pos += struct.calcsize(format)
+        return value[0] if len(value) == 1 else value
+
+    def read_string_ref(self):
+        start = self.pos
+        index = self.unpack(self.string_index)
+        if not 0 <= index < len(self.strings):
+            self.error("string {} out of range".format(index), start)
+        return self.strings[index]
+
+    def read_count(self):
+        start = self.pos
+        count = self.unpack('<i')
+        if count < 0:
+            self.error("negative count {}".format(count), start)
+        return count
+
+    def read_string(self):
+        end = self.data.find(b'\0', self.pos)
+        if end == -1:
+            self.error("unterminated string")
+        try:
+            value = bytes(self.data[self.pos:end]).decode('utf-8')
+        except UnicodeDecodeError:
+            self.error("invalid UTF-8 string")
+        self.pos = end + 1
+        return value
+
+    def read_attribute(self, keep):
+        name = self.read_string_ref()
+        type_id = self.unpack('<B')
+        count = None
+        if type_id > DMX_ARRAY_OFFSET:
+            type_id -= DMX_ARRAY_OFFSET
+            count = self.read_count()
+        if type_id not in DMX_BINARY_TYPES or (type_id == 7 and self.version < 3):
+            self.error("unknown attribute type {}".format(type_id))
+        type_name, size, format = DMX_BINARY_TYPES[type_id]
+        values = []
+        for _ in range(1 if count is None else count):
+            if type_name == 'element':
+                start = self.pos
+                index = self.unpack(format)
+                if index == -2:
+                    values.append(self.read_string())
+                elif -1 <= index < len(self.ids):
+                    values.append(self.ids[index] if index >= 0 else '')
+                else:
+                    self.error("element {} out of range".format(index), start)
+            elif type_name == 'string':
+                if count is None and self.version >= 4:
+                    values.append(self.read_string_ref())
+                else:
+                    values.append(self.read_string())
+            elif type_name == 'binary':
+                length = self.read_count()
+                if self.pos + length > len(self.data):
+                    self.error("unexpected end of data")
+                values.append(bytes(self.data[self.pos:self.pos + length]) if keep else None)
+                self.pos += length
+            elif keep:
+                values.append(format_dmx_value(type_name, self.unpack(format)))
+            else:
+                # Fixed size values (vertex data and the like) are skipped without decoding
+                self.pos += size * (1 if count is None else count)
+                if self.pos > len(self.data):
+                    self.error("unexpected end of data")
+                break
+        if not keep:
+            return None
+        if type_name == 'binary':
+            values = [format_dmx_value(type_name, value) for value in values]
+        if count is None:
+            return name, type_name, values[0]
+        return name, type_name + '_array', values
+
+def encode_dmx_value(type_name, text):
+    # Converts a keyvalues2 text value to its binary form
+    if type_name == 'int':
+        return struct.pack('<i', int(text))
+    if type_name == 'float':
+        return struct.pack('<f', float(text))
+    if type_name == 'bool':
+        return struct.pack('<B', text.strip().lower() in ('1', 'true'))
+    if type_name == 'time':
+        return struct.pack('<i', round(float(text) * 10000))
+    if type_name == 'binary':
+        data = bytes.fromhex(text)
+        return struct.pack('<i', len(data)) + data
+    _, _, format = DMX_BINARY_TYPES[DMX_BINARY_TYPE_IDS[type_name]]
+    if type_name == 'color':
+        return struct.pack(format, *(int(component) for component in text.split()))
+    return struct.pack(format, *(float(component) for component in text.split()))
+
+def write_binary_dmx(file, root, format_name='model', format_version=1, version=5):
+    # Writes a tree of DmxElements to a binary DMX file. Elements referenced by id that are
+    # not part of the tree are written as stubs
+    index_format = '<i' if version >= 5 else '<h'
+    elements = [root]
+    element_ids = {root.id: 0}
+    strings = {'name'}
+    for element in elements:
+        strings.add(element.type)
+        strings.add(element['name'][1] if 'name' in element else '')
+        for name, (attr_type, value) in element.items():
+            if name in ('id', 'name'):
+                continue
+            strings.add(name)
+            if attr_type == 'string' and version >= 4:
+                strings.add(value)
+            for item in (value if attr_type == 'element_array' else [value]):
+                if isinstance(item, DmxElement) and item.id not in element_ids:
+                    element_ids[item.id] = len(elements)
+                    elements.append(item)
+    strings = sorted(strings)
+    string_ids = {string: i for i, string in enumerate(strings)}
+
+    def string_ref(string):
+        return struct.pack(index_format, string_ids[string])
+
+    def element_ref(item):
+        if isinstance(item, DmxElement):
+            item = item.id
+        if item == '':
+            return struct.pack('<i', -1)
+        if item not in element_ids:
+            return struct.pack('<i', -2) + item.encode('utf-8') + b'\0'
+        return struct.pack('<i', element_ids[item])
+
+    out = [
+        '<!-- dmx encoding binary {} format {} {} -->\n'.format(version, format_name, format_version).encode('utf-8') + b'\0',
+        struct.pack('<i' if version >= 4 else '<h', len(strings)),
+        b''.join(string.encode('utf-8') + b'\0' for string in strings),
+        struct.pack('<i', len(elements)),
+    ]
+    for element in elements:
+        name = element['name'][1] if 'name' in element else ''
+        out.append(string_ref(element.type))
+        out.append(string_ref(name) if version >= 4 else name.encode('utf-8') + b'\0')
+        out.append(uuid.UUID(element.id).bytes_le)
+    for element in elements:
+        attributes = [(name, attribute) for name, attribute in element.items() if name not in ('id', 'name')]
+        out.append(struct.pack('<i', len(attributes)))
+        for name, (attr_type, value) in attributes:
+            if isinstance(value, DmxElement):
+                attr_type = 'element'
+            array = attr_type.endswith('_array')
+            type_name = attr_type[:-6] if array else attr_type
+            if type_name not in DMX_BINARY_TYPE_IDS or (type_name == 'time' and version < 3):
+                raise ValueError("Unsupported DMX attribute type '{}'".format(attr_type))
+            type_id = DMX_BINARY_TYPE_IDS[type_name]
+            out.append(string_ref(name))
+            out.append(struct.pack('<B', type_id + DMX_ARRAY_OFFSET if array else type_id))
+            if array:
+                out.append(struct.pack('<i', len(value)))
+            for item in (value if array else [value]):
+                if type_name == 'element':
+                    out.append(element_ref(item))
+                elif type_name == 'string':
+                    out.append(string_ref(item) if version >= 4 and not array else item.encode('utf-8') + b'\0')
+                else:
+                    out.append(encode_dmx_value(type_name, item))
+    file.write(b''.join(out))
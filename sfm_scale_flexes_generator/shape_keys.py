@@ -0,0 +1,84 @@
+import re
+
+# Scale keys are named after the bone or object they scale, the direction and the axis: 'upper-arm--posX'
+SCALE_KEY = re.compile(r'(.+)--(pos|neg)([XYZ])$')
+
+def key_owner(name):
+    # Bone or object name as it appears in scale key names
+    return name.replace("_", "-").replace(" ", "-")
+
+class ShapeKeyIndex:
+    # Shape keys of a mesh by name, with the scale keys parsed into their owner, direction and axis.
+    # Keys are looked up and matched once, then removed or renamed as a batch
+
+    def __init__(self, obj):
+        self.obj = obj
+        shape_keys = obj.data.shape_keys
+        self.keys = list(shape_keys.key_blocks) if shape_keys != None else []
+        self.reindex()
+
+    def reindex(self):
+        self.by_name = {key.name: key for key in self.keys}
+        self.scale_keys = {} # owner: (name, direction, axis) of its scale keys, the basis is never one
+        for key in self.keys[1:]:
+            match = SCALE_KEY.match(key.name)
+            if match != None:
+                owner, direction, axis = match.groups()
+                self.scale_keys.setdefault(owner, []).append((key.name, direction, axis))
+
+    def names(self):
+        return [key.name for key in self.keys]
+
+    def owned_by(self, owners):
+        # Names of the scale keys of the given bones or objects, already in key name form
+        return [name for owner in owners for name, direction, axis in self.scale_keys.get(owner, [])]
+
+    def remove(self, names):
+        # Removes the named keys, returns how many were removed. Blender removes keys one at a time,
+        # going from the last to the first leaves the ones still to remove where they were.
+        # Removed keys are invalid, the surviving ones are picked out before anything gets removed
+        doomed = set(names)
+        kept = self.keys[:1] + [key for key in self.keys[1:] if key.name not in doomed]
+        removed = [key for key in reversed(self.keys[1:]) if key.name in doomed]
+        for key in removed:
+            self.obj.shape_key_remove(key)
+        if len(removed) != 0:
+            self.keys = kept
+            self.reindex()
+        return len(removed)
+
+    def rename(self, renames):
+        # Renames keys from old to new name. A key whose new name is already used by a key that
+        # keeps its name, or by an earlier key of the batch, is left alone instead of getting
+        # a '.001' suffix from Blender. Returns the names of the keys left alone
+        renames = {old: new for old, new in renames.items() if old in self.by_name and old != new}
+        conflicts = []
+        # A key left alone keeps holding its old name, which may turn down renames accepted
+        # onto it, so conflicts are looked for again until there are no new ones
+        while True:
+            taken = set(self.by_name) - set(renames)
+            accepted = []
+            rejected = []
+            for old, new in renames.items():
+                if new in taken:
+                    rejected.append(old)
+                else:
+                    taken.add(new)
+                    accepted.append((self.by_name[old], new))
+            if len(rejected) == 0:
+                break
+            conflicts += rejected
+            for old in rejected:
+                del renames[old]
+
+        # Every key is moved out of the way first, so keys can take each other's names
+        for i, (key, new) in enumerate(accepted):
+            temporary = '~{}'.format(i)
+            while temporary in taken:
+                temporary += '~'
+            key.name = temporary
+        for key, new in accepted:
+            key.name = new
+        if len(accepted) != 0:
+            self.reindex()
+        return conflicts
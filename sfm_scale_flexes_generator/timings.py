@@ -0,0 +1,17 @@
+import time
+from contextlib import contextmanager
+
+class StageTimings(dict):
+    # Seconds spent in each stage of a run, by stage name in the order they first ran.
+    # A stage entered several times, like the chunks of a modal operator, accumulates its time
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = self.get(name, 0) + time.perf_counter() - start
+
+    def total(self):
+        return sum(self.values())
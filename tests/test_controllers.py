@@ -0,0 +1,94 @@
+import os, tempfile, unittest
+from sfm_scale_flexes_generator.controllers import build_controllers
+from sfm_scale_flexes_generator.dmx import KeyValues2Reader
+
+def control(index, name, raw_names=None):
+    raw_names = raw_names if raw_names != None else [name]
+    return '''			"DmeCombinationInputControl"
+			{{
+				"id" "elementid" "{:08x}-0000-0000-0000-000000000000"
+				"name" "string" "{}"
+				"rawControlNames" "string_array" [ {} ]
+				"stereo" "bool" "0"
+				"eyelid" "bool" "0"
+				"wrinkleScales" "float_array" [ {} ]
+			}},
+'''.format(index, name, ', '.join('"{}"'.format(raw) for raw in raw_names), ', '.join('"0"' for raw in raw_names))
+
+def source(names, controls_line='"controls" "element_array"\n\t\t[', before='', controls=None):
+    return '''<!-- dmx encoding keyvalues2 1 format model 1 -->
+"DmElement"
+{
+	"id" "elementid" "ffffffff-0000-0000-0000-000000000000"
+	"name" "string" "root"
+''' + before + '''	"combinationOperator" "DmeCombinationOperator"
+	{
+		"id" "elementid" "eeeeeeee-0000-0000-0000-000000000000"
+		''' + controls_line + '''
+''' + (controls if controls != None else ''.join(control(i, name) for i, name in enumerate(names))) + '''		]
+		"controlValues" "vector3_array" [ ]
+	}
+}
+'''
+
+def control_names(output):
+    return [[element['name'][1], element['rawControlNames'][1]] for element in KeyValues2Reader(output.encode('utf-8')).iter_elements('DmeCombinationInputControl')]
+
+class BuildControllersTest(unittest.TestCase):
+
+    def test_controllers(self):
+        output, count, orphans = build_controllers(source(['smile', 'arm--negX', 'arm--posX']))
+        self.assertEqual(count, 2)
+        self.assertEqual(orphans, [])
+        self.assertEqual(control_names(output), [['arm--scaleX', ['arm--negX', 'arm--posX']], ['smile', ['smile']]])
+
+    def test_orphaned_scale_keys(self):
+        output, count, orphans = build_controllers(source(['arm--posX', 'leg--negY', 'leg--negZ', 'leg--posZ']))
+        self.assertEqual(count, 3)
+        self.assertEqual(orphans, ['arm--posX', 'leg--negY'])
+        self.assertEqual(control_names(output), [['leg--scaleZ', ['leg--negZ', 'leg--posZ']], ['arm--posX', ['arm--posX']], ['leg--negY', ['leg--negY']]])
+
+    def test_header_is_copied_up_to_the_controls_array(self):
+        output, count, orphans = build_controllers(source(['smile']))
+        self.assertTrue(output.startswith(source([]).split('\t\t]\n')[0]))
+
+    def test_controls_bracket_on_the_attribute_line(self):
+        output, count, orphans = build_controllers(source(['smile'], controls_line='"controls" "element_array" ['))
+        self.assertEqual(control_names(output), [['smile', ['smile']]])
+
+    def test_earlier_element_array(self):
+        before = '\t"children" "element_array"\n\t[\n\t]\n'
+        output, count, orphans = build_controllers(source(['smile'], before=before))
+        self.assertIn(before, output)
+        self.assertEqual(control_names(output), [['smile', ['smile']]])
+
+    def test_hwm_controllers(self):
+        # The HWM controllers come first with the ids of the source, and the keys they drive
+        # get no other controller, scale pairs included
+        hwm = source([], controls=control(0xaaaa, 'jaw', ['jaw', 'smile']) + control(0xbbbb, 'arm', ['arm--negX', 'arm--posX']) + control(0xcccc, 'missing'))
+        with tempfile.TemporaryDirectory() as workdir:
+            hwm_path = os.path.join(workdir, 'hwm.dmx')
+            with open(hwm_path, 'w', encoding='utf-8') as file:
+                file.write(hwm)
+            output, count, orphans = build_controllers(source(['smile', 'jaw', 'arm--negX', 'arm--posX', 'leg--negX', 'leg--posX', 'blink']), hwm_path)
+        self.assertEqual(count, 4)
+        self.assertEqual(orphans, [])
+        self.assertEqual(control_names(output), [
+            ['jaw', ['jaw', 'smile']],
+            ['arm', ['arm--negX', 'arm--posX']],
+            ['leg--scaleX', ['leg--negX', 'leg--posX']],
+            ['blink', ['blink']],
+        ])
+        ids = [control.id for control in KeyValues2Reader(output.encode('utf-8')).iter_elements('DmeCombinationInputControl')]
+        self.assertEqual(ids[:2], ['00000001-0000-0000-0000-000000000000', '00000002-0000-0000-0000-000000000000'])
+
+    def test_not_keyvalues2(self):
+        with self.assertRaisesRegex(ValueError, "not a keyvalues2 DMX file"):
+            build_controllers('hello')
+
+    def test_without_combination_operator(self):
+        with self.assertRaisesRegex(ValueError, "no DmeCombinationOperator controls"):
+            build_controllers('<!-- dmx encoding keyvalues2 1 format model 1 -->\n"DmElement"\n{\n}\n')
+
+if __name__ == '__main__':
+    unittest.main()
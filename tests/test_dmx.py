@@ -0,0 +1,93 @@
+import io, struct, time, unittest
+from sfm_scale_flexes_generator.dmx import BinaryDmxReader, KeyValues2Reader, write_binary_dmx
+
+class KeyValues2ReaderTest(unittest.TestCase):
+
+    def test_skips_whitespace_and_comments(self):
+        data = b'<!-- dmx encoding keyvalues2 1 format model 1 -->\n// comment\n"DmElement" { // comment\n "name" "string" "a" , <!-- comment --> }'
+        self.assertEqual(KeyValues2Reader(data).roots(), [{'name': ['string', 'a']}])
+
+    def test_bad_character_after_long_whitespace_run(self):
+        # Used to backtrack over every split of the whitespace run before failing
+        data = b'"DmElement" {' + b' ' * 100000 + b'x'
+        start = time.perf_counter()
+        with self.assertRaisesRegex(ValueError, "unexpected character"):
+            KeyValues2Reader(data).roots()
+        self.assertLess(time.perf_counter() - start, 1)
+
+
+KV2_SOURCE = b'''<!-- dmx encoding keyvalues2 1 format model 1 -->
+"DmElement"
+{
+	"id" "elementid" "aaaaaaaa-0000-0000-0000-000000000000"
+	"name" "string" "root"
+	"combinationOperator" "DmeCombinationOperator"
+	{
+		"id" "elementid" "bbbbbbbb-0000-0000-0000-000000000000"
+		"name" "string" "combinationOperator"
+		"controls" "element_array"
+		[
+			"DmeCombinationInputControl"
+			{
+				"id" "elementid" "cccccccc-0000-0000-0000-000000000000"
+				"name" "string" "arm--scaleX"
+				"rawControlNames" "string_array" [ "arm--negX", "arm--posX" ]
+				"stereo" "bool" "0"
+				"wrinkleScales" "float_array" [ "0", "0.1" ]
+			},
+			"element" "dddddddd-0000-0000-0000-000000000000"
+		]
+		"controlValues" "vector3_array" [ "0 0 0.5" ]
+		"weight" "float" "0.3"
+		"count" "int" "-7"
+	}
+}
+'''
+
+class BinaryDmxTest(unittest.TestCase):
+
+    def write(self, version):
+        root = KeyValues2Reader(KV2_SOURCE).roots()[0]
+        file = io.BytesIO()
+        write_binary_dmx(file, root, version=version)
+        return file.getvalue()
+
+    def test_round_trip(self):
+        for version in (2, 3, 4, 5):
+            with self.subTest(version=version):
+                reader = BinaryDmxReader(self.write(version))
+                self.assertEqual(reader.version, version)
+                control, = reader.iter_elements('DmeCombinationInputControl')
+                self.assertEqual(control.id, 'cccccccc-0000-0000-0000-000000000000')
+                self.assertEqual(control['name'], ['string', 'arm--scaleX'])
+                self.assertEqual(control['rawControlNames'], ['string_array', ['arm--negX', 'arm--posX']])
+                self.assertEqual(control['stereo'], ['bool', '0'])
+                self.assertEqual(control['wrinkleScales'], ['float_array', ['0', '0.1']])
+                operator = reader.element('bbbbbbbb-0000-0000-0000-000000000000')
+                self.assertEqual(operator['controls'], ['element_array', ['cccccccc-0000-0000-0000-000000000000', 'dddddddd-0000-0000-0000-000000000000']])
+                self.assertEqual(operator['controlValues'], ['vector3_array', ['0 0 0.5']])
+                self.assertEqual(operator['weight'], ['float', '0.3'])
+                self.assertEqual(operator['count'], ['int', '-7'])
+
+    def test_truncated(self):
+        data = self.write(5)
+        for length in range(60, len(data) - 1, 7):
+            with self.subTest(length=length):
+                with self.assertRaisesRegex(ValueError, "Invalid binary DMX"):
+                    reader = BinaryDmxReader(data[:length])
+                    list(reader.iter_elements())
+
+    def test_string_out_of_range(self):
+        data = bytearray(self.write(5))
+        header = data.index(b'\0') + 1
+        string_count = struct.unpack_from('<i', data, header)[0]
+        strings_end = header + 4
+        for _ in range(string_count):
+            strings_end = data.index(b'\0', strings_end) + 1
+        # The type of the first element points past the string table
+        struct.pack_into('<i', data, strings_end + 4, string_count + 100)
+        with self.assertRaisesRegex(ValueError, "Invalid binary DMX: string 1.. out of range"):
+            BinaryDmxReader(bytes(data))
+
+if __name__ == '__main__':
+    unittest.main()
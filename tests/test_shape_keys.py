@@ -0,0 +1,89 @@
+import unittest
+from sfm_scale_flexes_generator.shape_keys import ShapeKeyIndex, key_owner
+
+class FakeKey:
+    # Key block that gets a '.001' suffix on name clashes and can't be used once removed, like Blender's
+    def __init__(self, obj, name):
+        self.obj = obj
+        self.removed = False
+        self._name = None
+        self.name = name
+
+    @property
+    def name(self):
+        if self.removed:
+            raise ReferenceError("key has been removed")
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        others = set(key._name for key in self.obj.keys if key is not self)
+        unique, suffix = name, 0
+        while unique in others:
+            suffix += 1
+            unique = '{}.{:03d}'.format(name, suffix)
+        self._name = unique
+
+class FakeObject:
+    def __init__(self, names):
+        self.keys = []
+        for name in names:
+            self.keys.append(FakeKey(self, name))
+        self.data = self
+        self.shape_keys = self if len(names) != 0 else None
+
+    @property
+    def key_blocks(self):
+        return list(self.keys)
+
+    def shape_key_remove(self, key):
+        self.keys.remove(key)
+        key.removed = True
+
+    def names(self):
+        return [key.name for key in self.keys]
+
+class ShapeKeyIndexTest(unittest.TestCase):
+
+    def test_key_owner(self):
+        self.assertEqual(key_owner("upper_arm L"), "upper-arm-L")
+
+    def test_owned_by_matches_whole_owner_names(self):
+        obj = FakeObject(['Basis', 'arm--posX', 'arm--negX', 'bigarm--posX', 'armpit', 'arm--posQ', 'a-b--negZ'])
+        index = ShapeKeyIndex(obj)
+        self.assertEqual(index.owned_by(['arm', 'a-b']), ['arm--posX', 'arm--negX', 'a-b--negZ'])
+
+    def test_remove(self):
+        obj = FakeObject(['Basis', 'arm--posX', 'arm--negX', 'leg--posY', 'smile'])
+        index = ShapeKeyIndex(obj)
+        self.assertEqual(index.remove(index.owned_by(['arm'])), 2)
+        self.assertEqual(obj.names(), ['Basis', 'leg--posY', 'smile'])
+        self.assertEqual(index.names(), ['Basis', 'leg--posY', 'smile'])
+        self.assertEqual(index.owned_by(['arm', 'leg']), ['leg--posY'])
+
+    def test_remove_never_removes_the_basis(self):
+        obj = FakeObject(['Basis', 'smile'])
+        self.assertEqual(ShapeKeyIndex(obj).remove(['Basis', 'smile']), 1)
+        self.assertEqual(obj.names(), ['Basis'])
+
+    def test_remove_without_shape_keys(self):
+        self.assertEqual(ShapeKeyIndex(FakeObject([])).remove(['smile']), 0)
+
+    def test_rename_swaps_and_chains(self):
+        obj = FakeObject(['Basis', 'x', 'y', 'a', 'b'])
+        self.assertEqual(ShapeKeyIndex(obj).rename({'x': 'y', 'y': 'x', 'a': 'b', 'b': 'c'}), [])
+        self.assertEqual(obj.names(), ['Basis', 'y', 'x', 'b', 'c'])
+
+    def test_rename_conflicts_keep_their_names(self):
+        obj = FakeObject(['Basis', 'smileL+smileR', 'smile', 'AL+AR', 'A2L+A2R'])
+        index = ShapeKeyIndex(obj)
+        self.assertEqual(index.rename({'smileL+smileR': 'smile', 'AL+AR': 'A', 'A2L+A2R': 'A'}), ['smileL+smileR', 'A2L+A2R'])
+        self.assertEqual(obj.names(), ['Basis', 'smileL+smileR', 'smile', 'A', 'A2L+A2R'])
+
+    def test_rename_onto_the_name_of_a_key_left_alone(self):
+        obj = FakeObject(['Basis', 'X', 'Z+1', 'Y'])
+        self.assertEqual(sorted(ShapeKeyIndex(obj).rename({'X': 'Y', 'Z+1': 'X'})), ['X', 'Z+1'])
+        self.assertEqual(obj.names(), ['Basis', 'X', 'Z+1', 'Y'])
+
+if __name__ == '__main__':
+    unittest.main()